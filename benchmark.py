@@ -0,0 +1,196 @@
+import argparse
+import random
+import tempfile
+import time
+from rich.console import Console
+from rich.table import Table
+from storage import BACKENDS, PRIORITIES, MemoryStore, open_store
+from tasklist import load_tasks
+
+console = Console()
+
+# A fixed bcrypt hash, so the benchmark measures storage and not hashing
+PASSWORD_HASH = '$2b$12$1oraKgjKN1DoMSlLk9LzD.ZoDx5ScgL7P/wKVV8xxIAtmIlYPdmRe'
+
+WORDS = [
+    'buy', 'groceries', 'call', 'mentors', 'book', 'tickets', 'email',
+    'judges', 'visit', 'family', 'trip', 'conference', 'present', 'send'
+]
+
+
+def make_tasks(count, seed):
+    """Build a reproducible list of tasks.
+
+    Args:
+        count (int): The number of tasks to build.
+        seed (int): The random seed, so every backend gets the same tasks.
+
+    Returns:
+        list: The tasks, as stored by the application.
+    """
+    rng = random.Random(seed)
+    return [
+        {
+            'task': ' '.join(rng.sample(WORDS, 3)).capitalize(),
+            'priority': rng.choice(PRIORITIES),
+            'due_date': (
+                f'20{rng.randint(25, 30)}-{rng.randint(1, 12):02d}-'
+                f'{rng.randint(1, 28):02d}'
+            ),
+            'done': False,
+            'id': task_id
+        }
+        for task_id in range(1, count + 1)
+    ]
+
+
+def query(store, task_list, username, method, *args):
+    """Run a task query as run.py does.
+
+    Returns:
+        list: The tasks the backend's index answers with, or those of the
+            task list's ``method`` if the backend has no index.
+    """
+    ids = getattr(store, method)(username, *args)
+    if ids is None:
+        return getattr(task_list, QUERIES[method])(*args)
+    return task_list.with_ids(ids)
+
+
+# The TaskList method that answers each Store query without an index
+QUERIES = {
+    'task_ids_matching': 'matching',
+    'task_ids_with_priority': 'with_priority',
+    'task_ids_by_due_date': 'by_due_date'
+}
+
+
+def run_workload(store, usernames, tasks):
+    """Run the register/login/add/search/by date workload on a store.
+
+    Searching and ordering by due date run as the application runs them:
+    on the backend's indexes where it has them, and on the loaded tasks
+    otherwise.
+
+    Args:
+        store (Store): The storage backend under test.
+        usernames (list): The users to register.
+        tasks (list): The tasks every user adds.
+
+    Returns:
+        tuple: The seconds spent in each phase, keyed by phase name, and
+            the results of the queries followed by the reloaded users,
+            used to check that the backends agree.
+    """
+    timings = {}
+    results = []
+    sessions = {}
+
+    start = time.perf_counter()
+    for username in usernames:
+        store.save_user(username, {'password': PASSWORD_HASH, 'tasks': []})
+    timings['register'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for username in usernames:
+        if store.load_credentials()[username] == PASSWORD_HASH:
+            sessions[username] = store.load_user(username)
+    timings['login'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for username, user_data in sessions.items():
+        for task in tasks:
+            task = dict(task)
+            user_data['tasks'].append(task)
+            store.save_user(username, user_data, {'op': 'add', 'task': task})
+    timings['add'] = time.perf_counter() - start
+
+    task_lists = {
+        username: load_tasks(user_data['tasks'])
+        for username, user_data in sessions.items()
+    }
+
+    start = time.perf_counter()
+    for username, task_list in task_lists.items():
+        for keyword in WORDS[:5]:
+            results.append(query(
+                store, task_list, username, 'task_ids_matching', keyword
+            ))
+        results.append(query(
+            store, task_list, username, 'task_ids_with_priority', 'High'
+        ))
+    timings['search'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for username, task_list in task_lists.items():
+        results.append(
+            query(store, task_list, username, 'task_ids_by_due_date')
+        )
+    timings['by date'] = time.perf_counter() - start
+
+    results[:] = [[task.to_dict() for task in tasks] for tasks in results]
+
+    start = time.perf_counter()
+    loaded = store.load_users()
+    timings['reload'] = time.perf_counter() - start
+
+    results.append({
+        username: {'password': user_data['password'],
+                   'tasks': user_data['tasks']}
+        for username, user_data in loaded.items()
+    })
+    return timings, results
+
+
+def expected_results(usernames, tasks):
+    """Compute the workload's results directly on Python lists.
+
+    Returns:
+        list: The results ``run_workload`` should return for any backend.
+    """
+    timings, results = run_workload(MemoryStore(), usernames, tasks)
+    return results
+
+
+def main():
+    """Benchmark the storage backends and check that they agree."""
+    parser = argparse.ArgumentParser(
+        description='Run the same workload against every storage backend.'
+    )
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--tasks', type=int, default=20)
+    parser.add_argument(
+        '--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS)
+    )
+    args = parser.parse_args()
+
+    usernames = [f'user{number:05d}' for number in range(args.users)]
+    tasks = make_tasks(args.tasks, seed=args.users)
+
+    table = Table(
+        title=f"{args.users} users x {args.tasks} tasks (ms)",
+        show_header=True, header_style="bold cyan"
+    )
+    table.add_column("Backend", style="bold white")
+    phases = ['register', 'login', 'add', 'search', 'by date', 'reload']
+    for phase in phases:
+        table.add_column(phase.capitalize(), justify="right")
+    table.add_column("Agrees", justify="center")
+
+    expected = expected_results(usernames, tasks)
+    for backend in args.backends:
+        with tempfile.TemporaryDirectory() as directory:
+            store = open_store(backend, directory=directory)
+            timings, results = run_workload(store, usernames, tasks)
+            store.close()
+        table.add_row(
+            backend,
+            *(f"{timings[phase] * 1000:.1f}" for phase in phases),
+            "✅" if results == expected else "❌"
+        )
+
+    console.print(table)
+
+
+if __name__ == "__main__":
+    main()
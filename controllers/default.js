@@ -15,8 +15,8 @@ function socket() {
 
     this.on('open', function (client) {
 
-        // Spawn terminal
-        client.tty = Pty.spawn('python3', ['run.py'], {
+        // Spawn terminal, served by a warm worker when prefork.py is running
+        client.tty = Pty.spawn('python3', ['prefork.py', 'attach'], {
             name: 'xterm-color',
             cols: 80,
             rows: 24,
@@ -38,7 +38,7 @@ function socket() {
 
     this.on('close', function (client) {
         if (client.tty) {
-            client.tty.kill(9);
+            client.tty.kill('SIGHUP');
             client.tty = null;
             console.log("Process killed and terminal unloaded");
         }
@@ -0,0 +1,172 @@
+import json
+import os
+import signal
+import socket
+import sys
+
+SOCKET_FILE = 'prefork.sock'
+
+# Environment a session passes on to the worker that serves it
+SESSION_ENV = ('TERM', 'COLUMNS', 'LINES', 'LANG', 'LC_ALL')
+
+
+def attach():
+    """Hand this terminal to a warm worker and wait for it to finish.
+
+    This is what each web terminal runs. It only imports the standard
+    library, sends its stdin, stdout and stderr to a worker over the
+    pool's socket and exits with the worker's exit status. If no pool is
+    running, or the worker dies before taking the session, it runs
+    run.py itself.
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(SOCKET_FILE)
+        env = {name: os.environ[name] for name in SESSION_ENV
+               if name in os.environ}
+        socket.send_fds(
+            connection, [json.dumps(env).encode('utf-8')], [0, 1, 2]
+        )
+        reply = connection.recv(4, socket.MSG_WAITALL)
+    except OSError:
+        reply = b''
+    if len(reply) < 4:
+        # No warm pool running, or no worker to serve this session
+        connection.close()
+        os.execv(sys.executable, [sys.executable, 'run.py'])
+    worker = int.from_bytes(reply, 'big')
+
+    def forward(signum, frame):
+        # The worker has no controlling terminal; pass on Ctrl-C and the
+        # hangup so that it saves its held back changes before exiting
+        try:
+            os.kill(worker, signum)
+        except ProcessLookupError:
+            pass
+
+    signal.signal(signal.SIGINT, forward)
+    signal.signal(signal.SIGHUP, forward)
+    signal.signal(signal.SIGTERM, forward)
+    status = connection.recv(1)
+    sys.exit(status[0] if status else 1)
+
+
+def work(listener, run):
+    """Serve one terminal session in a forked worker, then exit.
+
+    The worker opens its own storage handle and loads the credentials
+    before it accepts a session, so the session starts at the banner.
+    Whatever happens, the worker exits here and never returns to the
+    pool's loop.
+
+    Args:
+        listener (socket.socket): The pool's listening socket.
+        run (module): The imported run.py module.
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    status = 1
+    store = connection = None
+    try:
+        run.store = store = run.open_user_store()
+        credentials = run.load_credentials()
+
+        connection, address = listener.accept()
+        listener.close()
+        message, fds, flags, address = socket.recv_fds(connection, 4096, 3)
+        connection.sendall(os.getpid().to_bytes(4, 'big'))
+        os.environ.update(json.loads(message))
+        os.setsid()
+        for target, fd in enumerate(fds):
+            os.dup2(fd, target)
+            os.close(fd)
+        # Styles are detected from the terminal, which the worker only
+        # has now
+        run.console = run.LazyConsole()
+
+        run.main(credentials)
+        status = 0
+    except SystemExit as error:
+        status = error.code if isinstance(error.code, int) else 1
+    except (EOFError, KeyboardInterrupt, OSError):
+        # The terminal was closed
+        pass
+    except Exception:
+        import traceback
+        traceback.print_exc()
+    finally:
+        try:
+            # Save held back changes even if the terminal went away
+            if store is not None:
+                store.close()
+            sys.stdout.flush()
+            if connection is not None:
+                connection.sendall(bytes([status & 0xFF]))
+        except OSError:
+            pass
+        finally:
+            os._exit(status)
+
+
+def serve(workers):
+    """Keep a pool of forked workers ready for new terminal sessions.
+
+    The pool imports run.py, and with it rich, bcrypt and the storage
+    backend, once. Every worker is forked from it with all of that
+    already loaded and waits for a session; once a worker has served its
+    session it exits and a fresh one is forked.
+
+    Args:
+        workers (int): The number of workers to keep ready.
+    """
+    import run
+    # run.py defers these until they are first needed; warm them here
+    import bcrypt  # noqa: F401
+    import rich.console
+    import rich.table  # noqa: F401
+
+    if os.path.exists(SOCKET_FILE):
+        os.remove(SOCKET_FILE)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(SOCKET_FILE)
+    listener.listen(64)
+
+    children = set()
+
+    def stop(signum, frame):
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+        os.remove(SOCKET_FILE)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while True:
+        while len(children) < workers:
+            pid = os.fork()
+            if pid == 0:
+                work(listener, run)
+            children.add(pid)
+        pid, status = os.wait()
+        children.discard(pid)
+
+
+def main():
+    """Run the worker pool or attach a terminal to it.
+
+    Usage::
+
+        python3 prefork.py serve [workers]
+        python3 prefork.py attach
+    """
+    if sys.argv[1:2] == ['serve']:
+        serve(int(sys.argv[2]) if len(sys.argv) > 2 else 4)
+    elif sys.argv[1:2] == ['attach']:
+        attach()
+    else:
+        print(main.__doc__)
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,10 @@
-import json
 import os
-import bcrypt
+import sys
 import getpass
-from rich.console import Console
-from rich.table import Table
+import signal
 from datetime import datetime
+from storage import PRIORITIES, CoalescingStore, ConflictError, open_store
+from tasklist import Task, load_tasks
 
 ascii_art = r'''
  /$$$$$$$$             /$$$$$$$               /$$       /$$             /$$
@@ -17,42 +17,214 @@ ascii_art = r'''
    |__/ \______/      |_______/  \______/    |________/|__/|_______/    \___/
 '''
 
-console = Console()
+# Time to the first prompt that --import-profile checks against
+STARTUP_BUDGET_MS = 300
+
+
+class LazyConsole:
+    """Create the Rich console, and import rich, on first use.
+
+    Every attribute is looked up on the real ``rich.console.Console``.
+    """
+
+    def __init__(self):
+        self._console = None
+
+    def __getattr__(self, name):
+        if self._console is None:
+            from rich.console import Console
+            self._console = Console()
+        return getattr(self._console, name)
+
+
+console = LazyConsole()
 
 USER_DATA_FILE = 'users.json'
 
+# One of storage.BACKENDS: journal, sharded, binary, json, sqlite, dbm or
+# memory, or remote to use a running storage_server.py daemon
+STORAGE_BACKEND = os.environ.get('TODO_STORAGE', 'journal')
+
+# Task changes are written once this many are pending, or at the first
+# save after the oldest has waited this many seconds, and on logout/exit
+SAVE_BATCH = 10
+SAVE_DELAY = 2.0
+
+# When a keyword search finds nothing, tasks with words this many edits
+# (typos) away from the keyword's are shown instead
+FUZZY_DISTANCE = 2
+
+
+def open_user_store():
+    """Open the configured backend behind a change-coalescing layer.
+
+    Returns:
+        CoalescingStore: The store the application saves to.
+    """
+    return CoalescingStore(
+        open_store(STORAGE_BACKEND, legacy_file=USER_DATA_FILE),
+        max_changes=SAVE_BATCH, max_delay=SAVE_DELAY
+    )
+
+
+store = open_user_store()
+
 
 def load_users():
-    """Load user data from a JSON file.
+    """Load user data from the configured storage backend.
+
+    Returns:
+        dict: A dictionary containing user data. A new store is populated
+              from the legacy users.json file; if neither exists, returns
+              an empty dictionary.
+    """
+    return store.load_users()
+
+
+def load_credentials():
+    """Load the password hash of every user, without their tasks.
+
+    Returns:
+        dict: A mapping of usernames to password hashes.
+    """
+    return store.load_credentials()
+
+
+def load_user(username):
+    """Load the data of a single user, including their tasks.
+
+    Tasks saved before tasks had IDs are given theirs here, and saved
+    straight away so that later changes can refer to them. Due dates
+    stored without zero padding are saved normalized the same way.
+
+    Args:
+        username (str): The user to load.
 
     Returns:
-        dict: A dictionary containing user data. If the file is not found
-              or cannot be decoded, returns an empty dictionary.
+        dict: The user's data with their tasks in a TaskList, or None if
+              the user does not exist.
     """
-    if os.path.exists(USER_DATA_FILE):
-        with open(USER_DATA_FILE, 'r') as file:
-            return json.load(file)
-    return {}
+    while True:
+        user_data = store.load_user(username)
+        if user_data is None:
+            return None
+        user_data['tasks'] = load_tasks(user_data['tasks'])
+        tasks = user_data['tasks']
+        if not (tasks.assigned or tasks.normalized):
+            return user_data
+        try:
+            store.save_user(username, user_data)
+            return user_data
+        except ConflictError:
+            # Saved by another session meanwhile; load their version
+            continue
 
 
 def save_users(users):
-    """Save user data to a JSON file.
+    """Save the full data of every user.
 
     Args:
         users (dict): A dictionary containing user data to be saved.
 
+    Raises:
+        IOError: If there is an error while saving the files.
+    """
+    store.save_users(users)
+
+
+def save_user(username, user_data, change=None):
+    """Save a change to a single user.
+
+    If another session saved the user since their data was loaded, the
+    change is dropped and ``user_data`` is replaced in place with the
+    latest saved data, so the user can retry on up-to-date tasks.
+
+    Args:
+        username (str): The user whose data changed.
+        user_data (dict): The user's data, including their tasks. It is
+            saved in full when no change is given.
+        change (dict): The mutation that was made, e.g.
+            ``{'op': 'add', 'task': {...}}`` or
+            ``{'op': 'delete', 'id': 7}``.
+
+    Returns:
+        bool: True if the change was saved, False if it was dropped.
+
     Raises:
         IOError: If there is an error while saving the file.
     """
-    with open(USER_DATA_FILE, 'w') as file:
-        json.dump(users, file)
+    try:
+        store.save_user(username, user_data, change)
+        return True
+    except ConflictError:
+        latest = load_user(username)
+        if latest is not None:
+            user_data.clear()
+            user_data.update(latest)
+        console.print(
+            f"""[yellow]
+Your tasks were changed in another session. The latest tasks have been
+loaded, please try again.[/yellow]"""
+        )
+        return False
+
+
+def flush_changes():
+    """Write the task changes that are still held back.
+
+    Returns:
+        bool: True if they were saved, False if they were dropped because
+              another session changed the tasks first.
+    """
+    try:
+        store.flush()
+        return True
+    except ConflictError:
+        console.print(
+            f"""[yellow]
+Your tasks were changed in another session, so your latest changes
+could not be saved.[/yellow]"""
+        )
+        return False
+
+
+def query_store(method, username, *args):
+    """Answer a task query with the storage backend's indexes.
+
+    Held back changes are written first, so the answer covers them.
+
+    Args:
+        method (str): The ``Store`` query, e.g. ``'count_done'``.
+        username (str): The user whose tasks are queried.
+
+    Returns:
+        The answer, or None if the backend has no index, or the held back
+        changes were dropped because another session changed the tasks
+        first; the loaded tasks are queried instead then.
+    """
+    try:
+        return getattr(store, method)(username, *args)
+    except ConflictError:
+        console.print(
+            f"""[yellow]
+Your tasks were changed in another session, so your latest changes
+could not be saved.[/yellow]"""
+        )
+        return None
+
 
+def exit_on_signal(signum, frame):
+    """Save held back changes when the terminal is closed or killed."""
+    store.close()
+    sys.exit(128 + signum)
 
-def register(users):
+
+def register(credentials):
     """Register a new user.
 
     Args:
-        users (dict): A dictionary containing existing users.
+        credentials (dict): The password hashes of existing users, keyed
+        by username. The new user is added to it.
 
     Raises:
         ValueError: If the username already exists or is invalid.
@@ -69,7 +241,9 @@ Username cannot be empty. Please enter a valid username.[/red]"""
                 f"""[red]
 Username must be at least 4 characters long. Please try again.[/red]"""
             )
-        elif username in users:
+        elif username in credentials or store.username_taken(username):
+            # Also catches names registered by other sessions since we
+            # loaded the credentials
             console.print(
                 f"""[red]
 Username already exists. Please choose another one.[/red]"""
@@ -88,26 +262,39 @@ Password cannot be empty. Please enter a valid password.[/red]"""
 Password must be at least 4 characters long. Please try again.[/red]"""
                     )
                 else:
+                    import bcrypt
                     hashed_password = bcrypt.hashpw(
                         password.encode('utf-8'), bcrypt.gensalt()
                     )
-                    users[username] = {
+                    user_data = {
                         'password': hashed_password.decode('utf-8'),
                         'tasks': []
                     }
+                    try:
+                        # Save after registration
+                        store.save_user(username, user_data)
+                    except ConflictError:
+                        # Taken by another session since we started
+                        credentials.update(load_credentials())
+                        console.print(
+                            f"""[red]
+Username already exists. Please choose another one.[/red]"""
+                        )
+                        break
+                    credentials[username] = user_data['password']
                     console.print(
                         f"""[green]
 User '{username}' registered successfully![/green]"""
                     )
-                    save_users(users)  # Save after registration
                     return
 
 
-def login(users):
+def login(credentials):
     """Log in an existing user.
 
     Args:
-        users (dict): A dictionary containing existing users.
+        credentials (dict): The password hashes of existing users, keyed
+        by username.
 
     Returns:
         str: The username of the logged-in user.
@@ -131,9 +318,15 @@ Password must be at least 4 characters long. Please try again.[/red]"""
             )
             continue
 
-        if username in users and bcrypt.checkpw(
+        if username not in credentials:
+            # The user may have registered in another session
+            credentials.update(load_credentials())
+
+        import bcrypt
+
+        if username in credentials and bcrypt.checkpw(
                 password.encode('utf-8'),
-                users[username]['password'].encode('utf-8')
+                credentials[username].encode('utf-8')
         ):
             console.print(f"[green]Welcome back, {username}![/green]")
             return username
@@ -144,18 +337,29 @@ Invalid username or password. Please try again.[/red]"""
             )
 
 
-def show_tasks(tasks):
+def show_tasks(tasks, view=None, done=None):
     """Display the user's tasks in a formatted table.
 
+    The numbers in the table can then be turned back into task IDs with
+    ``tasks.task_id``.
+
     Args:
-        tasks (list): A list of tasks to display.
+        tasks (TaskList): The user's tasks.
+        view (list): The tasks to show, in order; all of them in list
+        order by default.
+        done (int): How many tasks are done, if the storage backend
+        counted them already.
     """
     if not tasks:
         console.print("[yellow]Your to-do list is empty.[/yellow]")
         return
 
+    if done is None:
+        done = tasks.completed()
+    from rich.table import Table
     table = Table(
-        title="To-Do List", show_header=True, header_style="bold cyan"
+        title="To-Do List", show_header=True, header_style="bold cyan",
+        caption=f"{done} of {len(tasks)} done"
     )
     table.add_column("No.", justify="right", style="bold magenta", width=3)
     table.add_column("Task", justify="left", style="bold white")
@@ -163,20 +367,20 @@ def show_tasks(tasks):
     table.add_column("Due Date", justify="center", style="bold yellow")
     table.add_column("Status", justify="center", style="bold green")
 
-    for index, task in enumerate(tasks, 1):
-        status = "✅" if task.get('done') else "❌"
-        due_date = task.get('due_date', 'N/A')
+    for index, task in tasks.numbered(view):
+        status = "✅" if task.done else "❌"
         table.add_row(
-            str(index), task['task'], task['priority'], due_date, status
+            str(index), task.title, task.priority, task.due_date, status
         )
 
     console.print(table)
 
 
-def add_task(user_data):
+def add_task(username, user_data):
     """Add a new task to the user's task list.
 
     Args:
+        username (str): The logged-in user, whose shard is rewritten.
         user_data (dict):
         A dictionary containing the user's data, including their tasks.
     """
@@ -201,7 +405,7 @@ Please enter a valid task.[/red]"""
             f"""[cyan]
 Set priority (High/Medium/Low) [example: High]: [/cyan]"""
         ).capitalize()
-        if priority in ["High", "Medium", "Low"]:
+        if priority in PRIORITIES:
             break
         else:
             console.print(
@@ -222,16 +426,14 @@ Enter due date (YYYY-MM-DD) [example: 2024-10-15]: [/cyan]"""
 Invalid date format! Please use YYYY-MM-DD.[/red]"""
             )
 
-    user_data['tasks'].append(
-        {
-            'task': task,
-            'priority': priority,
-            'due_date': due_date,
-            'done': False
-        }
+    new_task = user_data['tasks'].add(
+        Task(task, priority, Task.parse_due(due_date))
     )
-    console.print(f"[green]Task '{task}' added successfully![/green]")
-    save_users(users)  # Save after adding a task
+    # Save after adding a task
+    if save_user(
+        username, user_data, {'op': 'add', 'task': new_task.to_dict()}
+    ):
+        console.print(f"[green]Task '{task}' added successfully![/green]")
 
 
 def validate_date(date_text):
@@ -263,10 +465,11 @@ Please enter a valid present or future date.[/red]"""
         return False
 
 
-def delete_task(user_data):
+def delete_task(username, user_data):
     """Delete a task from the user's task list.
 
     Args:
+        username (str): The logged-in user, whose shard is rewritten.
         user_data (dict):
         A dictionary containing the user's data, including their tasks.
     """
@@ -293,18 +496,18 @@ Enter the task number to delete (or type 'back' to cancel): [/cyan]"""
             return
 
         # Validate task number input
-        if task_num.isdigit() and 1 <= int(
-                task_num
-            ) <= len(
-                user_data['tasks']
-        ):
+        task_id = user_data['tasks'].task_id(task_num)
+        if task_id is not None:
             # Perform task deletion
-            removed_task = user_data['tasks'].pop(int(task_num) - 1)
-            console.print(
-                f"""[green]
-Task '{removed_task['task']}' deleted successfully![/green]"""
-            )
-            save_users(users)  # Save after deleting a task
+            removed_task = user_data['tasks'].delete(task_id)
+            # Save after deleting a task
+            if save_user(
+                username, user_data, {'op': 'delete', 'id': task_id}
+            ):
+                console.print(
+                    f"""[green]
+Task '{removed_task.title}' deleted successfully![/green]"""
+                )
             break
         else:
             console.print(
@@ -313,10 +516,11 @@ Invalid task number! Please try again or type 'back' to cancel.[/red]"""
             )
 
 
-def mark_done(user_data):
+def mark_done(username, user_data):
     """Mark a task as done.
 
     Args:
+        username (str): The logged-in user, whose shard is rewritten.
         user_data (dict):
         A dictionary containing the user's data, including their tasks.
     """
@@ -342,19 +546,19 @@ Enter the task number to mark as done (or type 'back' to cancel): [/cyan]"""
             return
 
         # Validate task number input
-        if task_num.isdigit() and 1 <= int(
-            task_num
-        ) <= len(
-            user_data['tasks']
-        ):
+        task_id = user_data['tasks'].task_id(task_num)
+        if task_id is not None:
             # Mark the task as done
-            user_data['tasks'][int(task_num) - 1]['done'] = True
-            console.print(
-                f"""[green]
-Task '{user_data['tasks'][int(task_num) - 1]['task']}'
+            marked_task = user_data['tasks'].mark_done(task_id)
+            # Save after marking a task as done
+            if save_user(
+                username, user_data, {'op': 'done', 'id': task_id}
+            ):
+                console.print(
+                    f"""[green]
+Task '{marked_task.title}'
 marked as done successfully![/green]"""
-            )
-            save_users(users)  # Save after marking a task as done
+                )
             break
         else:
             console.print(
@@ -363,10 +567,11 @@ Invalid task number! Please try again or type 'back' to cancel.[/red]"""
             )
 
 
-def edit_task(user_data):
+def edit_task(username, user_data):
     """Edit an existing task in the user's task list.
 
     Args:
+        username (str): The logged-in user, whose shard is rewritten.
         user_data (dict):
         A dictionary containing the user's data, including their tasks.
     """
@@ -378,6 +583,7 @@ No tasks to edit. Please add a task first.[/yellow]"""
         return
 
     # Display tasks in a table format
+    from rich.table import Table
     table = Table(title="Task List")
 
     table.add_column("No.", justify="center", style="cyan", no_wrap=True)
@@ -385,36 +591,37 @@ No tasks to edit. Please add a task first.[/yellow]"""
     table.add_column("Priority", justify="center", style="green")
     table.add_column("Due Date", justify="center", style="yellow")
 
-    for idx, task in enumerate(user_data['tasks'], 1):
+    for idx, task in user_data['tasks'].numbered():
         table.add_row(
-            str(idx), task['task'], task['priority'], task['due_date']
+            str(idx), task.title, task.priority, task.due_date
         )
 
     console.print(table)
 
     # Select the task to edit
     while True:
-        try:
-            task_num = int(console.input(
-                f"""[cyan]
+        task_num = console.input(
+            f"""[cyan]
 Enter the task number you want to edit: [/cyan]"""
-            ))
-            if 1 <= task_num <= len(user_data['tasks']):
-                selected_task = user_data['tasks'][task_num - 1]
-                break
-            else:
-                console.print(
-                    f"""[red]
-Invalid task number! Please enter a valid task number.[/red]"""
-                )
-        except ValueError:
+        ).strip()
+        if not task_num.isdigit():
             console.print("[red]Please enter a valid number.[/red]")
+            continue
+        task_id = user_data['tasks'].task_id(task_num)
+        if task_id is not None:
+            selected_task = user_data['tasks'].get(task_id)
+            break
+        else:
+            console.print(
+                f"""[red]
+Invalid task number! Please enter a valid task number.[/red]"""
+            )
 
     # Update task name
     while True:
         new_task_name = console.input(
             f"""[cyan]
-Enter new name for the task '{selected_task['task']}': [/cyan]"""
+Enter new name for the task '{selected_task.title}': [/cyan]"""
         ).strip()
         if not new_task_name or not new_task_name.replace(' ', '').isalpha():
             console.print(
@@ -423,7 +630,7 @@ Task name cannot be blank, contain numbers, or special characters!
 Only alphabetic characters allowed.[/red]"""
             )
         else:
-            selected_task['task'] = new_task_name
+            selected_task.title = new_task_name
             break
 
     # Update priority
@@ -432,8 +639,8 @@ Only alphabetic characters allowed.[/red]"""
             f"""[cyan]
 Set new priority (High/Medium/Low): [/cyan]"""
         ).capitalize()
-        if new_priority in ["High", "Medium", "Low"]:
-            selected_task['priority'] = new_priority
+        if new_priority in PRIORITIES:
+            selected_task.priority = new_priority
             break
         else:
             console.print(
@@ -447,25 +654,36 @@ Invalid priority! Please enter High, Medium, or Low.[/red]"""
             f"""[cyan]Enter new due date (YYYY-MM-DD): [/cyan]"""
         )
         if validate_date(new_due_date):
-            selected_task['due_date'] = new_due_date
+            selected_task.set_due(Task.parse_due(new_due_date))
             break
         else:
             console.print(
                 f"""[red]Invalid date format! Please use YYYY-MM-DD.[/red]"""
             )
 
-    console.print(
-        f"""[green]
-Task '{selected_task['task']}' updated successfully![/green]"""
-    )
-    save_users(users)  # Save after editing a task
+    user_data['tasks'].replace(task_id, selected_task)
+    # Save after editing a task
+    if save_user(
+        username, user_data,
+        {'op': 'edit', 'id': task_id, 'task': selected_task.to_dict()}
+    ):
+        console.print(
+            f"""[green]
+Task '{selected_task.title}' updated successfully![/green]"""
+        )
 
 
-def filter_tasks(user_data):
-    """Filter tasks based on a specified priority
+def filter_tasks(username, user_data):
+    """Filter tasks based on a specified priority, or on a query,
     and display them in a table format.
 
+    A query combines conditions on the priority, the done flag, the due
+    date and the title, e.g. ``priority:high done:false due:<2024-11-01
+    "email"``; see ``search.parse_query``. A priority alone is looked up
+    in the storage backend's index where it has one.
+
     Args:
+        username (str): The logged-in user.
         user_data (dict):
         A dictionary containing the user's data, including their tasks.
     """
@@ -474,30 +692,46 @@ def filter_tasks(user_data):
         console.print("[yellow]No tasks available to filter.[/yellow]")
         return
 
-    # Prompt user for priority to filter tasks
-    priority = console.input(
-        f"""[cyan]Enter priority to filter tasks (High/Medium/Low): [/cyan]"""
-    ).capitalize()
-    if priority not in ["High", "Medium", "Low"]:
+    # Prompt user for priority, or a query, to filter tasks
+    console.print(
+        "[cyan]Queries look like: "
+        'priority:high done:false due:<2024-11-01 "email"[/cyan]'
+    )
+    text = console.input(
+        f"""[cyan]Enter priority to filter tasks (High/Medium/Low) \
+or a query: [/cyan]"""
+    ).strip()
+    priority = text.capitalize()
+    if not text:
         console.print(
             f"""[red]
 Invalid priority! Please enter High, Medium, or Low.[/red]"""
         )
         return
-
-    # Filter tasks by priority
-    filtered_tasks = [
-        task for task in user_data['tasks'] if task['priority'] == priority
-    ]
+    if priority in PRIORITIES:
+        ids = query_store('task_ids_with_priority', username, priority)
+        if ids is None:
+            filtered_tasks = user_data['tasks'].with_priority(priority)
+        else:
+            filtered_tasks = user_data['tasks'].with_ids(ids)
+        description = f"with '{priority}' priority"
+        title = f"Tasks with '{priority}' Priority"
+    else:
+        try:
+            filtered_tasks = user_data['tasks'].query(text)
+        except ValueError as error:
+            console.print(f"[red]Invalid query! {error}[/red]")
+            return
+        description = f"matching '{text}'"
+        title = f"Tasks Matching '{text}'"
 
     if not filtered_tasks:
-        console.print(
-            f"""[yellow]No tasks found with '{priority}' priority.[/yellow]"""
-        )
+        console.print(f"[yellow]No tasks found {description}.[/yellow]")
         return
 
     # Display filtered tasks in a table format
-    table = Table(title=f"Tasks with '{priority}' Priority")
+    from rich.table import Table
+    table = Table(title=title)
 
     table.add_column("No.", justify="center", style="cyan", no_wrap=True)
     table.add_column("Task", style="magenta")
@@ -506,17 +740,23 @@ Invalid priority! Please enter High, Medium, or Low.[/red]"""
 
     for idx, task in enumerate(filtered_tasks, 1):
         table.add_row(
-            str(idx), task['task'], task['priority'], task['due_date']
+            str(idx), task.title, task.priority, task.due_date
         )
 
     console.print(table)
 
 
-def search_tasks(user_data):
+def search_tasks(username, user_data):
     """Search tasks based on a keyword and
     display matching tasks in a table format.
 
+    The matching tasks are found by the storage backend where it has an
+    index, and ranked by relevance, priority and due date. If no title
+    contains the keyword, tasks with words within ``FUZZY_DISTANCE``
+    typos of the keyword's are shown instead.
+
     Args:
+        username (str): The logged-in user.
         user_data (dict): A dictionary containing the user's data,
         including their tasks.
     """
@@ -533,21 +773,27 @@ def search_tasks(user_data):
         console.print("[red]Keyword cannot be blank.[/red]")
         return
 
-    # Filter tasks by keyword
-    matching_tasks = [
-        task for task in user_data[
-            'tasks'
-        ] if keyword.lower() in task[
-            'task'
-        ].lower()
-    ]
+    # Filter tasks by keyword, best matches first, allowing for typos if
+    # nothing matches
+    tasks = user_data['tasks']
+    ids = query_store('task_ids_matching', username, keyword)
+    matching_tasks = tasks.ranked_matching(
+        keyword, tasks=None if ids is None else tasks.with_ids(ids)
+    )
+    title = f"Tasks Matching '{keyword}'"
+    if not matching_tasks:
+        matching_tasks = user_data['tasks'].fuzzy_matching(
+            keyword, FUZZY_DISTANCE
+        )
+        title = f"Tasks Similar to '{keyword}'"
 
     if not matching_tasks:
         console.print(f"[yellow]No tasks found matching '{keyword}'.[/yellow]")
         return
 
     # Display matching tasks in a table format
-    table = Table(title=f"Tasks Matching '{keyword}'")
+    from rich.table import Table
+    table = Table(title=title)
 
     table.add_column("No.", justify="center", style="cyan", no_wrap=True)
     table.add_column("Task", style="magenta")
@@ -556,35 +802,29 @@ def search_tasks(user_data):
 
     for idx, task in enumerate(matching_tasks, 1):
         table.add_row(
-            str(idx), task['task'], task['priority'], task['due_date']
+            str(idx), task.title, task.priority, task.due_date
         )
 
     console.print(table)
 
 
-def sort_tasks_by_date(user_data):
-    """Sort the user's tasks by their due date.
+def show_tasks_by_date(username, user_data):
+    """Display the user's tasks by their due date.
 
-    This function sorts the tasks by the due date in ascending order.
-    If a task has 'N/A' as the due date,
-    it is treated as the maximum possible date for sorting purposes.
+    Tasks due 'N/A', or on a date that could not be read, come last.
+    The order comes from the storage backend's index where it has one;
+    otherwise the tasks are kept in due date order as they change. So
+    this neither sorts them nor changes the order they were added in.
 
     Args:
+        username (str): The logged-in user.
         user_data (dict): A dictionary containing the user's data,
         including their tasks.
     """
-    try:
-        user_data['tasks'].sort(
-            key=lambda task: datetime.strptime(
-                task['due_date'], '%Y-%m-%d'
-            ) if task['due_date'] != 'N/A' else datetime.max
-        )
-        console.print("[green]Tasks sorted by due date successfully![/green]")
-    except ValueError:
-        console.print(
-            f"""[red]
-Error sorting tasks. Some tasks may have invalid dates.[/red]"""
-        )
+    tasks = user_data['tasks']
+    ids = query_store('task_ids_by_due_date', username)
+    view = tasks.by_due_date() if ids is None else tasks.with_ids(ids)
+    show_tasks(tasks, view, query_store('count_done', username))
 
 
 def clear_screen():
@@ -598,13 +838,21 @@ def clear_screen():
     # os.system('cls')  # Use this for Windows
 
 
-def main():
+def main(credentials=None):
     """Run the task manager application.
 
     This function handles user registration, login, and task management.
+
+    Args:
+        credentials (dict): Password hashes loaded in advance, e.g. by a
+        warm prefork.py worker. They are loaded here if not given.
     """
-    global users  # Use global variable to access users in nested functions
-    users = load_users()
+    # Only the password hashes are loaded up front; a user's tasks are
+    # loaded once they have logged in
+    if credentials is None:
+        credentials = load_credentials()
+    signal.signal(signal.SIGTERM, exit_on_signal)
+    signal.signal(signal.SIGHUP, exit_on_signal)
     console.print(ascii_art)
 
     while True:
@@ -615,10 +863,17 @@ def main():
         choice = console.input("[cyan]Choose an option (1-3): [/cyan]")
         clear_screen()
         if choice == "1":
-            register(users)
+            register(credentials)
         elif choice == "2":
-            username = login(users)
-            user_data = users[username]  # Retrieve the logged-in user's data
+            username = login(credentials)
+            user_data = load_user(username)  # Load the logged-in user's data
+            if user_data is None:
+                # The credentials outlived the user's data
+                console.print(
+                    f"""[red]
+Your tasks could not be loaded. Please try again.[/red]"""
+                )
+                continue
 
             while True:
                 console.print("[cyan]To-Do List Main Menu:[cyan]")
@@ -636,29 +891,27 @@ def main():
                 )
                 clear_screen()
                 if user_choice == "1":
-                    add_task(user_data)
+                    add_task(username, user_data)
                     clear_screen()
                 elif user_choice == "2":
-                    delete_task(user_data)
+                    delete_task(username, user_data)
                 elif user_choice == "3":
-                    mark_done(user_data)
+                    mark_done(username, user_data)
                 elif user_choice == "4":
-                    edit_task(user_data)
+                    edit_task(username, user_data)
                 elif user_choice == "5":
-                    show_tasks(user_data['tasks'])
+                    show_tasks(
+                        user_data['tasks'],
+                        done=query_store('count_done', username)
+                    )
                 elif user_choice == "6":
-                    filter_tasks(user_data)
+                    filter_tasks(username, user_data)
                 elif user_choice == "7":
-                    search_tasks(user_data)
+                    search_tasks(username, user_data)
                 elif user_choice == "8":
-                    sort_tasks_by_date(user_data)
-                    console.print(
-                        f"""[green]
-Tasks sorted by due date successfully![/green]"""
-                    )
-                    clear_screen()
-                    show_tasks(user_data['tasks'])
+                    show_tasks_by_date(username, user_data)
                 elif user_choice == "9":
+                    flush_changes()
                     console.print(
                         f"""[green]You successfully logged out...[/green]"""
                     )
@@ -670,6 +923,7 @@ Invalid choice! Please choose a number between 1 and 9.[/red]"""
                     )
         elif choice == "3":
             console.print("[green]Exiting the program.[/green]")
+            flush_changes()
             break
         else:
             console.print(
@@ -678,5 +932,81 @@ Invalid choice! Please choose a number between 1 and 3.[/red]"""
             )
 
 
+def profile_startup():
+    """Report what a new session spends its time on before the first prompt.
+
+    The application is started in a child interpreter with
+    ``-X importtime`` and timed until it prints the first menu's prompt;
+    it is then answered with Exit. Its imports are listed by cumulative
+    time next to that time-to-first-prompt.
+
+    Returns:
+        int: 0 if the time-to-first-prompt is within STARTUP_BUDGET_MS,
+             1 otherwise.
+    """
+    import subprocess
+    import tempfile
+    import time
+    from rich.table import Table
+
+    # The import times go to a file, so the child never blocks on a full
+    # stderr pipe while only stdout is read
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        child = subprocess.Popen(
+            [sys.executable, '-X', 'importtime', __file__],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr
+        )
+        output = b''
+        while b'Choose an option' not in output:
+            chunk = os.read(child.stdout.fileno(), 4096)
+            if not chunk:
+                # The child exited before prompting
+                break
+            output += chunk
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        child.communicate(b'3\n')
+        stderr.seek(0)
+        report = stderr.read().decode('utf-8', 'replace')
+
+    imports = []
+    for line in report.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        # Nested imports are indented; only report the top-level ones
+        if module.startswith('  '):
+            continue
+        imports.append(
+            (module.strip(), int(self_us) / 1000, int(cumulative_us) / 1000)
+        )
+    imports.sort(key=lambda item: item[2], reverse=True)
+
+    table = Table(
+        title="Imports before the first prompt", show_header=True,
+        header_style="bold cyan"
+    )
+    table.add_column("Module", justify="left", style="bold white")
+    table.add_column("Self (ms)", justify="right")
+    table.add_column("Cumulative (ms)", justify="right", style="bold yellow")
+    for module, self_ms, cumulative_ms in imports:
+        table.add_row(module, f"{self_ms:.1f}", f"{cumulative_ms:.1f}")
+    console.print(table)
+
+    within_budget = elapsed_ms <= STARTUP_BUDGET_MS
+    style = "green" if within_budget else "red"
+    console.print(
+        f"[{style}]Time to first prompt: {elapsed_ms:.0f} ms "
+        f"(budget {STARTUP_BUDGET_MS} ms)[/{style}]"
+    )
+    return 0 if within_budget else 1
+
+
 if __name__ == "__main__":
-    main()
+    if '--import-profile' in sys.argv[1:]:
+        sys.exit(profile_startup())
+    try:
+        main()
+    finally:
+        # Save held back changes even on EOF or Ctrl-C
+        store.close()
@@ -0,0 +1,504 @@
+import re
+import shlex
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter
+from datetime import date, datetime
+from functools import lru_cache
+from math import log
+
+# A word of a task title: a run of letters, digits or underscores
+WORD = re.compile(r'\w+')
+
+# The usual BM25 parameters: how soon repeating a word stops adding to
+# a score, and how much long titles are discounted
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def words(text):
+    """Return the set of lowercased words of a text."""
+    return set(WORD.findall(text.lower()))
+
+
+def trigrams(text):
+    """Return the set of three-character slices of a lowercased text."""
+    text = text.lower()
+    return {text[start:start + 3] for start in range(len(text) - 2)}
+
+
+def _has(posting, seq):
+    """Return whether a sorted posting holds a number."""
+    index = bisect_left(posting, seq)
+    return index < len(posting) and posting[index] == seq
+
+
+def _intersect(postings):
+    """Return the numbers in every one of some postings.
+
+    The smallest posting is the starting set; a much longer posting is
+    probed with ``bisect`` for each number left instead of being read.
+    """
+    postings = sorted(postings, key=len)
+    found = set(postings[0])
+    for posting in postings[1:]:
+        if len(found) * 16 < len(posting):
+            found = {seq for seq in found if _has(posting, seq)}
+        else:
+            found.intersection_update(posting)
+        if not found:
+            break
+    return found
+
+
+def edit_distance(first, second):
+    """Return the Levenshtein distance between two strings.
+
+    This is the number of single-character insertions, deletions and
+    substitutions that turn one string into the other.
+    """
+    if len(first) < len(second):
+        first, second = second, first
+    # Common ends cost nothing, and similar words share most of theirs
+    start = 0
+    while start < len(second) and first[start] == second[start]:
+        start += 1
+    end = 0
+    while (end < len(second) - start
+           and first[-1 - end] == second[-1 - end]):
+        end += 1
+    first = first[start:len(first) - end]
+    second = second[start:len(second) - end]
+    if not second:
+        return len(first)
+    previous = list(range(len(second) + 1))
+    for row, char in enumerate(first, 1):
+        current = [row]
+        left = row
+        for column, other in enumerate(second):
+            # The cheapest of substituting, deleting and inserting
+            cost = previous[column] + (char != other)
+            above = previous[column + 1] + 1
+            if above < cost:
+                cost = above
+            if left + 1 < cost:
+                cost = left + 1
+            current.append(cost)
+            left = cost
+        previous = current
+    return previous[-1]
+
+
+class BKTree:
+    """A BK-tree of words, for finding the words near a misspelling.
+
+    Each node is a word and its children, keyed by their edit distance
+    from it. Since edit distance obeys the triangle inequality, a search
+    within ``max_distance`` of a word at distance d from a node only
+    descends into the children keyed d - max_distance to
+    d + max_distance, and skips the rest of the tree.
+    """
+
+    def __init__(self, words=()):
+        self.root = None
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        """Add a word, unless the tree has it already."""
+        if self.root is None:
+            self.root = (word, {})
+            return
+        node, children = self.root
+        while True:
+            distance = edit_distance(word, node)
+            if distance == 0:
+                return
+            child = children.get(distance)
+            if child is None:
+                children[distance] = (word, {})
+                return
+            node, children = child
+
+    def search(self, word, max_distance):
+        """Return the words within an edit distance of a word.
+
+        Returns:
+            list: The words, in no particular order.
+        """
+        found = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node, children = stack.pop()
+            distance = edit_distance(word, node)
+            if distance <= max_distance:
+                found.append(node)
+            for gap in range(max(1, distance - max_distance),
+                             distance + max_distance + 1):
+                child = children.get(gap)
+                if child is not None:
+                    stack.append(child)
+        return found
+
+
+class TitleIndex:
+    """Inverted indexes of the titles of a user's tasks, for search.
+
+    Tasks are numbered in list order as they are indexed, and a task
+    keeps its number when its title changes. Two inverted indexes map
+    terms to the numbers of the tasks whose lowercased title has them,
+    each posting a sorted ``array('I')``, which takes four bytes a task
+    rather than a set entry:
+
+    ``words``
+        The words of the titles.
+    ``trigrams``
+        Every three-character slice of the titles, spaces and
+        punctuation included.
+
+    Each task's title is kept, rather than its terms, so that a task can
+    be reindexed or removed after its Task has been changed in place.
+
+    ``total_words`` counts the words of all titles, repeats included, so
+    that BM25 scoring has the average title length at hand; the number
+    of tasks with a word is the length of its posting.
+
+    For fuzzy search, the words are also kept in a BKTree, built on the
+    first fuzzy search. Words are only ever added to it; one whose last
+    task is gone is skipped when found, as it has no posting.
+    """
+
+    def __init__(self):
+        self.titles = {}
+        self.seqs = {}
+        # The task ID of each number, or 0 once the task is removed
+        self.ids = array('I')
+        self.words = {}
+        self.trigrams = {}
+        self._word_tree = None
+        self.total_words = 0
+
+    def __len__(self):
+        return len(self.titles)
+
+    def add(self, task_id, title):
+        """Index a task's title, or reindex it if the title changed."""
+        old_title = self.titles.get(task_id)
+        if old_title == title:
+            return
+        if old_title is None:
+            self.seqs[task_id] = len(self.ids)
+            self.ids.append(task_id)
+            old_title = ''
+        seq = self.seqs[task_id]
+        old_words = WORD.findall(old_title.lower())
+        new_words = WORD.findall(title.lower())
+        self.total_words += len(new_words) - len(old_words)
+        new_words = set(new_words)
+        self._repost(self.words, seq, set(old_words), new_words)
+        if self._word_tree is not None:
+            for word in new_words:
+                self._word_tree.add(word)
+        self._repost(
+            self.trigrams, seq, trigrams(old_title), trigrams(title)
+        )
+        self.titles[task_id] = title
+
+    def remove(self, task_id):
+        """Drop a task from the indexes."""
+        title = self.titles.pop(task_id)
+        seq = self.seqs.pop(task_id)
+        self.ids[seq] = 0
+        title_words = WORD.findall(title.lower())
+        self.total_words -= len(title_words)
+        self._repost(self.words, seq, set(title_words), set())
+        self._repost(self.trigrams, seq, trigrams(title), set())
+
+    @staticmethod
+    def _repost(postings, seq, old, new):
+        """Move a task number from the postings of old to new terms."""
+        for term in old - new:
+            posting = postings[term]
+            del posting[bisect_left(posting, seq)]
+            if not posting:
+                del postings[term]
+        for term in new - old:
+            posting = postings.get(term)
+            if posting is None:
+                postings[term] = array('I', (seq,))
+            elif posting[-1] < seq:
+                # New tasks have the highest number, so go at the end
+                posting.append(seq)
+            else:
+                insort(posting, seq)
+
+    def _task_ids(self, found):
+        """Return the task IDs of a set of numbers, in list order."""
+        return list(map(self.ids.__getitem__, sorted(found)))
+
+    def word_candidates(self, keyword):
+        """Return the IDs of the tasks whose title may contain a keyword.
+
+        Every word of the keyword is looked up among the distinct words
+        of all titles, which are far fewer than the tasks, and the tasks
+        under any word containing it are candidates.
+
+        Returns:
+            list: The task IDs in list order, or None if the keyword has
+                no words to look up, e.g. '-'.
+        """
+        parts = words(keyword)
+        if not parts:
+            return None
+        found = None
+        for part in parts:
+            containing = set()
+            for word, posting in self.words.items():
+                if part in word:
+                    containing.update(posting)
+            found = containing if found is None else found & containing
+            if not found:
+                return []
+        return self._task_ids(found)
+
+    def trigram_candidates(self, keyword):
+        """Return the IDs of the tasks whose title may contain a keyword.
+
+        A title containing the keyword has all of its trigrams, so the
+        candidates are the tasks in all of their postings.
+
+        Returns:
+            list: The task IDs in list order, or None if the keyword is
+                shorter than a trigram.
+        """
+        grams = trigrams(keyword)
+        if not grams:
+            return None
+        postings = []
+        for gram in grams:
+            posting = self.trigrams.get(gram)
+            if posting is None:
+                return []
+            postings.append(posting)
+        return self._task_ids(_intersect(postings))
+
+    def candidates(self, keyword):
+        """Return the IDs of the tasks whose title may contain a keyword.
+
+        The caller checks the candidates' titles, since the indexes only
+        rule tasks out.
+
+        Args:
+            keyword (str): The keyword, matched case-insensitively.
+
+        Returns:
+            list: The task IDs in list order, or None if the keyword can
+                not be looked up and every task must be checked.
+        """
+        found = self.trigram_candidates(keyword)
+        if found is None:
+            found = self.word_candidates(keyword)
+        return found
+
+    def fuzzy_candidates(self, keyword, max_distance):
+        """Return the IDs of the tasks with words near a keyword's.
+
+        Each word of the keyword matches the title words within
+        ``max_distance`` edits of it, but within no more than a third of
+        its length, so that short words do not match almost anything. A
+        task matches if it has a match for every word of the keyword.
+
+        Args:
+            keyword (str): The keyword, possibly misspelled.
+            max_distance (int): The most edits allowed per word.
+
+        Returns:
+            list: The task IDs in list order.
+        """
+        if self._word_tree is None:
+            self._word_tree = BKTree(self.words)
+        found = None
+        for part in words(keyword):
+            limit = min(max_distance, len(part) // 3)
+            near = set()
+            for word in self._word_tree.search(part, limit):
+                posting = self.words.get(word)
+                if posting:
+                    near.update(posting)
+            found = near if found is None else found & near
+            if not found:
+                return []
+        return [] if found is None else self._task_ids(found)
+
+    def scores(self, keyword, ids):
+        """Return the BM25 relevance of some tasks' titles to a keyword.
+
+        A word of the keyword stands for every title word containing it,
+        as in search, so 'groc' scores titles with 'groceries'. Rare words
+        weigh more than common ones, a word repeated in a title adds less
+        each time, and long titles are discounted.
+
+        Args:
+            keyword (str): The keyword.
+            ids (list): The IDs of the tasks to score.
+
+        Returns:
+            list: The score of each task, in the order of ``ids``.
+        """
+        count = len(self.titles)
+        if not count:
+            return [0.0] * len(ids)
+        average = self.total_words / count or 1
+        weights = {}
+        for part in words(keyword):
+            for word, posting in self.words.items():
+                if part in word and word not in weights:
+                    found = len(posting)
+                    weights[word] = log(
+                        1 + (count - found + 0.5) / (found + 0.5)
+                    )
+        scores = []
+        for task_id in ids:
+            title_words = WORD.findall(self.titles[task_id].lower())
+            norm = BM25_K1 * (
+                1 - BM25_B + BM25_B * len(title_words) / average
+            )
+            score = 0.0
+            for word, repeats in Counter(title_words).items():
+                weight = weights.get(word)
+                if weight:
+                    score += (
+                        weight * repeats * (BM25_K1 + 1) / (repeats + norm)
+                    )
+            scores.append(score)
+        return scores
+
+
+class Query:
+    """A parsed task query, compiled to a single predicate.
+
+    ``priority`` and ``done`` are None when not constrained. Due dates
+    are kept as ordinal days: ``first_day`` and ``last_day`` bound the
+    due date, inclusively, or ``undated`` asks for tasks without one.
+    ``keywords`` must all be in the title, case-insensitively.
+    """
+
+    __slots__ = ('priority', 'done', 'first_day', 'last_day', 'undated',
+                 'keywords', 'matches')
+
+    def __init__(self):
+        self.priority = None
+        self.done = None
+        self.first_day = None
+        self.last_day = None
+        self.undated = False
+        self.keywords = []
+
+    @property
+    def dated(self):
+        """Whether the query bounds the due date."""
+        return self.first_day is not None or self.last_day is not None
+
+    def compile(self):
+        """Set ``matches`` to a predicate testing a Task in one call.
+
+        Only the constrained fields are tested, cheapest first, and the
+        values are bound once here rather than looked up per task.
+        """
+        checks = []
+        if self.done is not None:
+            done = self.done
+            checks.append(lambda task: task.done == done)
+        if self.priority is not None:
+            priority = self.priority
+            checks.append(lambda task: task.priority == priority)
+        if self.undated:
+            checks.append(lambda task: task.due is None)
+        elif self.dated:
+            first = self.first_day or 1
+            last = self.last_day or date.max.toordinal()
+            checks.append(
+                lambda task: task.due is not None and first <= task.day <= last
+            )
+        if self.keywords:
+            keywords = self.keywords
+            checks.append(lambda task: all(
+                keyword in task.title.lower() for keyword in keywords
+            ))
+        if not checks:
+            self.matches = lambda task: True
+        elif len(checks) == 1:
+            self.matches = checks[0]
+        else:
+            self.matches = lambda task: all(check(task) for check in checks)
+
+
+def _parse_day(text):
+    try:
+        return date.fromisoformat(text).toordinal()
+    except ValueError:
+        try:
+            return datetime.strptime(text, '%Y-%m-%d').toordinal()
+        except ValueError:
+            raise ValueError(f"'{text}' is not a YYYY-MM-DD date.") from None
+
+
+@lru_cache(maxsize=256)
+def parse_query(text):
+    """Parse and compile a task query.
+
+    A query is a list of terms, all of which a task must match::
+
+        priority:high done:false due:<2024-11-01 "email judges"
+
+    ``priority:`` takes high, medium or low, and ``done:`` true or false
+    (or yes or no). ``due:`` takes a YYYY-MM-DD date, which may follow
+    <, <=, > or >=, or none for tasks without a due date, and may be
+    given twice for a range. Anything else is a keyword the title must
+    contain; quote it to include spaces. Queries are cached, since the
+    same few are typed again and again.
+
+    Returns:
+        Query: The compiled query. Treat it as read-only, as it is
+            shared by every caller of the same text.
+
+    Raises:
+        ValueError: If the query cannot be parsed.
+    """
+    query = Query()
+    for term in shlex.split(text):
+        field, colon, value = term.partition(':')
+        field = field.lower()
+        if not colon or field not in ('priority', 'done', 'due'):
+            if term.strip():
+                query.keywords.append(term.lower())
+        elif field == 'priority':
+            if value.capitalize() not in ('High', 'Medium', 'Low'):
+                raise ValueError(
+                    f"Priority '{value}' should be high, medium or low."
+                )
+            query.priority = value.capitalize()
+        elif field == 'done':
+            if value.lower() not in ('true', 'false', 'yes', 'no'):
+                raise ValueError(
+                    f"Done '{value}' should be true or false."
+                )
+            query.done = value.lower() in ('true', 'yes')
+        elif value.lower() in ('none', 'n/a'):
+            query.undated = True
+        else:
+            operator = value[:2] if value[:2] in ('<=', '>=') else (
+                value[:1] if value[:1] in ('<', '>') else ''
+            )
+            day = _parse_day(value[len(operator):])
+            if operator in ('', '>', '>='):
+                first = day + (operator == '>')
+                query.first_day = max(query.first_day or first, first)
+            if operator in ('', '<', '<='):
+                last = day - (operator == '<')
+                query.last_day = min(query.last_day or last, last)
+    if query.undated and query.dated:
+        raise ValueError("A task cannot be due both on no date and a date.")
+    query.keywords = tuple(query.keywords)
+    query.compile()
+    return query
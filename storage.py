@@ -0,0 +1,2061 @@
+import dbm
+import fcntl
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime
+
+
+# The keys of a stored task, and its priorities from highest to lowest
+TASK_KEYS = frozenset(('task', 'priority', 'due_date', 'done', 'id'))
+PRIORITIES = ('High', 'Medium', 'Low')
+
+# The due day of tasks without a readable date, so that they sort last
+NO_DUE_DATE = 0x7FFFFFFF
+
+
+def parse_due_date(text):
+    """Parse a YYYY-MM-DD due date.
+
+    Returns:
+        date: The date, or None for 'N/A'.
+
+    Raises:
+        ValueError: If the text is not a date.
+    """
+    if text == 'N/A':
+        return None
+    try:
+        # Much faster than strptime for the usual zero-padded dates
+        return date.fromisoformat(text)
+    except ValueError:
+        return datetime.strptime(text, '%Y-%m-%d').date()
+
+
+def due_day(due_date):
+    """Return the day a stored due date sorts on in the due date order.
+
+    Returns:
+        int: The date's ordinal, or ``NO_DUE_DATE`` for 'N/A' and dates
+            that cannot be read.
+    """
+    try:
+        due = parse_due_date(due_date)
+    except (TypeError, ValueError):
+        return NO_DUE_DATE
+    return due.toordinal() if due else NO_DUE_DATE
+
+
+class ConflictError(Exception):
+    """Raised when a user was saved by another session since it was loaded.
+
+    Every save of a user bumps their ``version``. A save only succeeds if
+    the version the session loaded is still the stored one.
+    """
+
+
+def stored_version(user_data):
+    """Return the version of a stored user, or None if there is no user."""
+    if user_data is None:
+        return None
+    return user_data.get('version', 0)
+
+
+def next_version(username, user_data, current):
+    """Compare-and-swap check for saving a user.
+
+    Args:
+        username (str): The user being saved.
+        user_data (dict): The session's copy of the user. A new user has
+            no ``version`` yet.
+        current (int): The stored version, or None if the user does not
+            exist yet.
+
+    Returns:
+        int: The version to save the user with.
+
+    Raises:
+        ConflictError: If the stored version is not the one the session
+            loaded, or a new user's name has been taken meanwhile.
+    """
+    if user_data.get('version') != current:
+        raise ConflictError(username)
+    return (current or 0) + 1
+
+
+def apply_change(users, change):
+    """Apply a single journaled mutation to a dictionary of users.
+
+    Args:
+        users (dict): A dictionary containing user data, updated in place.
+        change (dict): A journal record naming the ``user`` and the ``op``
+            ('user', 'add', 'delete', 'done' or 'edit'), and the user's
+            ``version`` after the change.
+    """
+    op = change['op']
+    if op == 'user':
+        users[change['user']] = change['data']
+    else:
+        _apply_task_change(users[change['user']]['tasks'], change)
+    if 'version' in change:
+        users[change['user']]['version'] = change['version']
+
+
+def task_position(tasks, change):
+    """Return the list position of the task a change refers to.
+
+    Changes name a task by its stable ``id``.
+
+    Raises:
+        ValueError: If no task has the change's ID.
+    """
+    for position, task in enumerate(tasks):
+        if task.get('id') == change['id']:
+            return position
+    raise ValueError(f"No task with id {change['id']}")
+
+
+def _apply_task_change(tasks, change):
+    op = change['op']
+    if op == 'add':
+        tasks.append(change['task'])
+    elif op == 'delete':
+        del tasks[task_position(tasks, change)]
+    elif op == 'done':
+        tasks[task_position(tasks, change)]['done'] = True
+    elif op == 'edit':
+        tasks[task_position(tasks, change)] = change['task']
+    else:
+        raise ValueError(f"Unknown journal operation '{op}'")
+
+
+@contextmanager
+def file_lock(path, blocking=True):
+    """Hold an exclusive advisory lock on a lock file.
+
+    Args:
+        path (str): The lock file, created if missing.
+        blocking (bool): Whether to wait for the lock. When False and the
+            lock is held elsewhere, the context yields False.
+
+    Yields:
+        bool: True if the lock was acquired.
+    """
+    with open(path, 'a') as lock:
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(lock, flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def write_files(files):
+    """Replace files so that a crash leaves either their old or new data.
+
+    Each file is written to a temporary file next to it, which is synced
+    to disk and then renamed over the file. The renames of the whole
+    batch are made durable together with one sync per directory, so
+    saving many shards costs one directory sync rather than one each.
+
+    Args:
+        files (dict): The objects to write as JSON, or bytes to write as
+            they are, keyed by path.
+    """
+    renamed = []
+    try:
+        for path, data in files.items():
+            temporary = f'{path}.{os.getpid()}-{threading.get_ident()}.tmp'
+            with open(temporary, 'wb') as file:
+                if not isinstance(data, bytes):
+                    data = json.dumps(data).encode('utf-8')
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            renamed.append((temporary, path))
+        for temporary, path in renamed:
+            os.replace(temporary, path)
+    finally:
+        for temporary, path in renamed:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+    for directory in {os.path.dirname(path) or '.' for path in files}:
+        descriptor = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+
+
+def iter_users(path, chunk_size=64 * 1024):
+    """Yield the users of a users.json file one at a time.
+
+    The top-level mapping is read in chunks and each user's record is
+    decoded on its own, so memory use is bounded by the largest single
+    user rather than by the size of the file.
+
+    Args:
+        path (str): The users.json file.
+        chunk_size (int): How many characters to read at a time.
+
+    Yields:
+        tuple: The username and the user's data.
+
+    Raises:
+        ValueError: If the file is not a JSON object.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as file:
+        buffer = ''
+        position = 0
+        at_end = False
+
+        def more():
+            nonlocal buffer, position, at_end
+            # Grow the reads while a value spans many chunks
+            data = file.read(max(chunk_size, len(buffer) - position))
+            buffer = buffer[position:] + data
+            position = 0
+            at_end = not data
+
+        def token():
+            """Return the next non-whitespace character, or ''."""
+            nonlocal position
+            while True:
+                while position < len(buffer) and buffer[position].isspace():
+                    position += 1
+                if position < len(buffer) or at_end:
+                    return buffer[position:position + 1]
+                more()
+
+        def value():
+            nonlocal position
+            while True:
+                try:
+                    result, position = decoder.raw_decode(buffer, position)
+                    return result
+                except json.JSONDecodeError:
+                    if at_end:
+                        raise
+                    more()
+
+        if token() != '{':
+            raise ValueError(f'{path} does not hold a JSON object')
+        position += 1
+        if token() == '}':
+            return
+        while True:
+            username = value()
+            if token() != ':':
+                raise ValueError(f'Expected ":" after {username!r}')
+            position += 1
+            token()
+            yield username, value()
+            separator = token()
+            position += 1
+            if separator == '}':
+                return
+            if separator != ',':
+                raise ValueError(f'Expected "," after user {username!r}')
+            token()
+
+
+def iter_batches(users, size=1000):
+    """Group ``(username, user_data)`` pairs into dictionaries of users.
+
+    Migrations save a large users.json in these batches so that it is
+    never held in memory at once.
+
+    Args:
+        users (iterable): Pairs as yielded by ``iter_users``.
+        size (int): The most users in a batch.
+
+    Yields:
+        dict: A dictionary containing user data keyed by username.
+    """
+    batch = {}
+    for username, user_data in users:
+        batch[username] = user_data
+        if len(batch) >= size:
+            yield batch
+            batch = {}
+    if batch:
+        yield batch
+
+
+# Binary task records: a flags byte holding the priority in bits 0-1,
+# done in bit 2, a missing ('N/A') due date in bit 3 and an ID in bit 4,
+# then the 4-byte ID if any, the due date as a 4-byte ordinal day unless
+# missing, then the title as a 2-byte length and UTF-8. A task that does
+# not fit, e.g. with a malformed date or extra keys, is kept as JSON
+# behind the RAW_TASK flag instead.
+DONE_FLAG = 0x04
+NO_DUE_DATE_FLAG = 0x08
+ID_FLAG = 0x10
+RAW_TASK = 0x80
+BINARY_MAGIC = b'TODO\x01'
+TITLE_SIZE = struct.Struct('<H')
+TASK_ID = struct.Struct('<I')
+DATED_TITLE_SIZE = struct.Struct('<IH')
+
+
+def _pack_task(task):
+    """Return the binary record of a task, or None if it does not fit."""
+    # Every key, with or without the ID
+    if set(task) | {'id'} != TASK_KEYS:
+        return None
+    if (task['priority'] not in PRIORITIES
+            or not isinstance(task['done'], bool)
+            or not isinstance(task['task'], str)):
+        return None
+    flags = PRIORITIES.index(task['priority'])
+    if task['done']:
+        flags |= DONE_FLAG
+    task_id = b''
+    if 'id' in task:
+        if (type(task['id']) is not int
+                or not 0 <= task['id'] <= 0xFFFFFFFF):
+            return None
+        task_id = TASK_ID.pack(task['id'])
+        flags |= ID_FLAG
+    due_date = task['due_date']
+    if due_date == 'N/A':
+        day = b''
+        flags |= NO_DUE_DATE_FLAG
+    else:
+        try:
+            parsed = datetime.strptime(due_date, '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            return None
+        if parsed.isoformat() != due_date:
+            # e.g. '2024-10-1' would not come back as written
+            return None
+        day = parsed.toordinal().to_bytes(4, 'little')
+    title = task['task'].encode('utf-8')
+    if len(title) > 0xFFFF:
+        return None
+    return (
+        bytes([flags]) + task_id + day + len(title).to_bytes(2, 'little')
+        + title
+    )
+
+
+def encode_user(user_data):
+    """Encode a user in the compact binary shard format.
+
+    The user's fields other than ``tasks`` are kept as a JSON header;
+    each task becomes one binary record.
+
+    Args:
+        user_data (dict): The user's data, including their tasks.
+
+    Returns:
+        bytes: The encoded user.
+    """
+    header = {
+        key: value for key, value in user_data.items() if key != 'tasks'
+    }
+    header = json.dumps(header).encode('utf-8')
+    parts = [
+        BINARY_MAGIC, len(header).to_bytes(4, 'little'), header,
+        len(user_data['tasks']).to_bytes(4, 'little')
+    ]
+    for task in user_data['tasks']:
+        record = _pack_task(task)
+        if record is None:
+            raw = json.dumps(task).encode('utf-8')
+            record = (
+                bytes([RAW_TASK]) + len(raw).to_bytes(4, 'little') + raw
+            )
+        parts.append(record)
+    return b''.join(parts)
+
+
+def decode_user(data):
+    """Decode a user written by ``encode_user``.
+
+    Args:
+        data (bytes): The encoded user.
+
+    Returns:
+        dict: The user's data, equal to what was encoded.
+
+    Raises:
+        ValueError: If the data is not in the binary shard format.
+    """
+    if not data.startswith(BINARY_MAGIC):
+        raise ValueError('Not a binary user record')
+    position = len(BINARY_MAGIC)
+    size = int.from_bytes(data[position:position + 4], 'little')
+    position += 4
+    user_data = json.loads(data[position:position + size])
+    position += size
+    count = int.from_bytes(data[position:position + 4], 'little')
+    position += 4
+    tasks = []
+    # Many tasks share a due date; format each day once
+    dates = {}
+    for _ in range(count):
+        flags = data[position]
+        position += 1
+        if flags & RAW_TASK:
+            size = int.from_bytes(data[position:position + 4], 'little')
+            position += 4
+            tasks.append(json.loads(data[position:position + size]))
+            position += size
+            continue
+        if flags & ID_FLAG:
+            task_id, = TASK_ID.unpack_from(data, position)
+            position += TASK_ID.size
+        if flags & NO_DUE_DATE_FLAG:
+            due_date = 'N/A'
+            size, = TITLE_SIZE.unpack_from(data, position)
+            position += TITLE_SIZE.size
+        else:
+            day, size = DATED_TITLE_SIZE.unpack_from(data, position)
+            position += DATED_TITLE_SIZE.size
+            due_date = dates.get(day)
+            if due_date is None:
+                due_date = dates[day] = date.fromordinal(day).isoformat()
+        task = {
+            'task': data[position:position + size].decode('utf-8'),
+            'priority': PRIORITIES[flags & 0x03],
+            'due_date': due_date,
+            'done': bool(flags & DONE_FLAG)
+        }
+        if flags & ID_FLAG:
+            task['id'] = task_id
+        tasks.append(task)
+        position += size
+    user_data['tasks'] = tasks
+    return user_data
+
+
+class UsernameFilter:
+    """A Bloom filter of registered usernames.
+
+    A username that was added is always reported present; about one in a
+    hundred others is wrongly reported present too, so a hit must be
+    confirmed with an exact lookup. The filter is stored as a small
+    header followed by its bit array.
+    """
+
+    BITS_PER_NAME = 10
+    HASHES = 7
+    MAGIC = b'BLM1'
+    HEADER = struct.Struct('<4sII')
+
+    def __init__(self, capacity=1024):
+        """Create an empty filter.
+
+        Args:
+            capacity (int): How many names the filter is sized for before
+                its false positive rate starts to climb.
+        """
+        self.capacity = capacity
+        self.count = 0
+        self.bits = bytearray((capacity * self.BITS_PER_NAME + 7) // 8)
+
+    @classmethod
+    def build(cls, usernames):
+        """Create a filter of the given names, with room to grow."""
+        usernames = list(usernames)
+        names = cls(max(1024, 2 * len(usernames)))
+        for username in usernames:
+            names.add(username)
+        return names
+
+    def _positions(self, username):
+        digest = hashlib.blake2b(
+            username.encode('utf-8'), digest_size=16
+        ).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        size = len(self.bits) * 8
+        return [(first + i * second) % size for i in range(self.HASHES)]
+
+    def add(self, username):
+        for position in self._positions(username):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, username):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(username)
+        )
+
+    def to_bytes(self):
+        return (
+            self.HEADER.pack(self.MAGIC, self.capacity, self.count)
+            + bytes(self.bits)
+        )
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Load a filter written by ``to_bytes``.
+
+        Raises:
+            ValueError: If the data is not a stored filter.
+        """
+        magic, capacity, count = cls.HEADER.unpack_from(data)
+        names = cls(capacity)
+        bits = data[cls.HEADER.size:]
+        if magic != cls.MAGIC or len(bits) != len(names.bits):
+            raise ValueError('Not a stored username filter')
+        names.count = count
+        names.bits[:] = bits
+        return names
+
+
+class Store:
+    """Base class of the storage backends.
+
+    Every backend implements ``load_users``, ``load_user``, ``save_user``
+    and ``save_users``. A user is a dictionary with a ``password`` hash,
+    a list of ``tasks`` and a ``version``. ``save_user`` is told which
+    change was made (see ``apply_change``) so that backends can write just
+    that change, and refuses to overwrite a newer version of the user.
+
+    Backends that index the tasks, such as SQLite, also answer the
+    ``task_ids_*`` and ``count_done`` queries and set ``INDEXED_QUERIES``;
+    the others return None from them, and the session answers them from
+    its loaded tasks.
+    """
+
+    INDEXED_QUERIES = False
+
+    def load_users(self):
+        """Load every user.
+
+        Returns:
+            dict: A dictionary containing user data keyed by username.
+        """
+        raise NotImplementedError
+
+    def load_user(self, username):
+        """Load a single user.
+
+        Returns:
+            dict: The user's data including their ``version``, or None if
+                the user does not exist.
+        """
+        raise NotImplementedError
+
+    def load_credentials(self):
+        """Load the password hash of every user, without their tasks.
+
+        Backends that keep credentials apart from tasks override this so
+        that nobody's tasks are parsed before a user logs in.
+
+        Returns:
+            dict: A mapping of usernames to bcrypt password hashes.
+        """
+        return {
+            username: user_data['password']
+            for username, user_data in self.load_users().items()
+        }
+
+    def username_taken(self, username):
+        """Return whether a username is already registered.
+
+        Backends that can answer without loading the user override this.
+        The answer is only advisory: registering still fails with
+        ``ConflictError`` if the name was taken meanwhile.
+        """
+        return self.load_user(username) is not None
+
+    def save_user(self, username, user_data, change=None):
+        """Save a change to a single user if nobody else saved it first.
+
+        On success ``user_data['version']`` is bumped to the saved version.
+
+        Args:
+            username (str): The user whose data changed.
+            user_data (dict): The user's data after the change, saved in
+                full when no change is given (e.g. on registration).
+            change (dict): The mutation that was made, e.g.
+                ``{'op': 'add', 'task': {...}}``.
+
+        Raises:
+            ConflictError: If the user was saved by another session since
+                ``user_data`` was loaded.
+        """
+        raise NotImplementedError
+
+    def save_users(self, users):
+        """Save the full data of every given user, without version checks.
+
+        Args:
+            users (dict): A dictionary containing user data to be saved.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Finish any background work and release the backend."""
+
+    def task_ids_with_priority(self, username, priority):
+        """Return the IDs of a user's tasks with a priority, in list order.
+
+        Returns:
+            list: The task IDs, or None if the backend has no index.
+        """
+        return None
+
+    def task_ids_matching(self, username, keyword):
+        """Return the IDs of the tasks whose title contains a keyword.
+
+        The match is a case-insensitive substring match.
+
+        Returns:
+            list: The task IDs in list order, or None if the backend has
+                no index.
+        """
+        return None
+
+    def task_ids_by_due_date(self, username):
+        """Return the IDs of a user's tasks by due date.
+
+        Tasks due 'N/A', or on a date that cannot be read, come last, and
+        tasks due the same day are ordered by ID.
+
+        Returns:
+            list: The task IDs, or None if the backend has no index.
+        """
+        return None
+
+    def count_done(self, username):
+        """Return how many of a user's tasks are done.
+
+        Returns:
+            int: The count, or None if the backend has no index.
+        """
+        return None
+
+
+class JsonFileStore(Store):
+    """Store every user in a single JSON file.
+
+    This is the original users.json layout: every save rewrites the whole
+    file. Each save also writes a sidecar index, ``<path>.idx``, holding
+    every user's byte offset and length in the file and their password
+    hash. Logging in reads the credentials from the index and seeks
+    straight to the one user's record.
+
+    If the index is missing or out of date, e.g. because the file was
+    edited by hand, lookups stream through the file with ``iter_users``
+    instead.
+    """
+
+    def __init__(self, path):
+        """Create a store backed by one JSON file.
+
+        Args:
+            path (str): The JSON file, e.g. users.json.
+        """
+        self.path = path
+        self.index_path = f'{path}.idx'
+
+    def _load_index(self):
+        """Return the offset index if it matches the data file, or None.
+
+        Returns:
+            dict: A mapping of usernames to ``[offset, length, password]``.
+        """
+        try:
+            with open(self.index_path, 'r') as file:
+                index = json.load(file)
+            if index['size'] != os.path.getsize(self.path):
+                return None
+        except (OSError, ValueError, KeyError):
+            return None
+        return index['users']
+
+    def _read_record(self, username, offset, length):
+        """Decode one user's record, or return None if it is not there."""
+        with open(self.path, 'rb') as file:
+            file.seek(offset)
+            record = file.read(length).decode('utf-8')
+        decoder = json.JSONDecoder()
+        try:
+            name, position = decoder.raw_decode(record)
+            if name != username or record[position:position + 2] != ': ':
+                return None
+            user_data, position = decoder.raw_decode(record, position + 2)
+        except ValueError:
+            return None
+        return user_data if position == len(record) else None
+
+    def load_users(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as file:
+                return json.load(file)
+        return {}
+
+    def load_user(self, username):
+        if not os.path.exists(self.path):
+            return None
+        index = self._load_index()
+        if index is not None:
+            if username not in index:
+                return None
+            offset, length, password = index[username]
+            user_data = self._read_record(username, offset, length)
+            if user_data is not None:
+                user_data.setdefault('version', 0)
+                return user_data
+        for name, user_data in iter_users(self.path):
+            if name == username:
+                user_data.setdefault('version', 0)
+                return user_data
+        return None
+
+    def load_credentials(self):
+        if not os.path.exists(self.path):
+            return {}
+        index = self._load_index()
+        if index is not None:
+            return {
+                username: password
+                for username, (offset, length, password) in index.items()
+            }
+        return {
+            username: user_data['password']
+            for username, user_data in iter_users(self.path)
+        }
+
+    def save_user(self, username, user_data, change=None):
+        with file_lock(f'{self.path}.lock'):
+            users = self.load_users()
+            user_data['version'] = next_version(
+                username, user_data, stored_version(users.get(username))
+            )
+            users[username] = user_data
+            self._write(users)
+
+    def save_users(self, users):
+        with file_lock(f'{self.path}.lock'):
+            stored = self.load_users()
+            stored.update(users)
+            self._write(stored)
+
+    def _write(self, users):
+        """Write the data file and its offset index in one batch.
+
+        The file is laid out exactly as ``json.dump`` would write it.
+        """
+        parts = [b'{']
+        offset = 1
+        index = {}
+        for username, user_data in users.items():
+            if offset > 1:
+                parts.append(b', ')
+                offset += 2
+            record = (
+                json.dumps(username) + ': ' + json.dumps(user_data)
+            ).encode('utf-8')
+            index[username] = [offset, len(record), user_data['password']]
+            parts.append(record)
+            offset += len(record)
+        parts.append(b'}')
+        write_files({
+            self.path: b''.join(parts),
+            self.index_path: {'size': offset + 1, 'users': index}
+        })
+
+
+class MemoryStore(Store):
+    """Keep users in memory only, e.g. for benchmarks and experiments.
+
+    Users are copied in and out as JSON, so callers never share
+    dictionaries with the store.
+    """
+
+    def __init__(self, legacy_file=None):
+        """Create an empty store.
+
+        Args:
+            legacy_file (str): An optional users.json to start from.
+        """
+        self.users = {}
+        self.versions = {}
+        if legacy_file and os.path.exists(legacy_file):
+            self.users = {
+                username: json.dumps(user_data)
+                for username, user_data in iter_users(legacy_file)
+            }
+
+    def load_users(self):
+        return {
+            username: json.loads(user_data)
+            for username, user_data in self.users.items()
+        }
+
+    def load_user(self, username):
+        user_data = self.users.get(username)
+        if user_data is None:
+            return None
+        return dict({'version': 0}, **json.loads(user_data))
+
+    def save_user(self, username, user_data, change=None):
+        current = self.versions.get(username)
+        if current is None and username in self.users:
+            current = stored_version(self.load_user(username))
+        user_data['version'] = next_version(username, user_data, current)
+        self.versions[username] = user_data['version']
+        self.users[username] = json.dumps(user_data)
+
+    def save_users(self, users):
+        for username, user_data in users.items():
+            self.users[username] = json.dumps(user_data)
+            self.versions.pop(username, None)
+
+
+class ShardedStore(Store):
+    """Store every user in a JSON shard of their own.
+
+    The store directory holds one file per user plus a small
+    ``index.json`` mapping each username to its shard and password hash,
+    so a change to one user's tasks only rewrites that user's file and
+    logging in never reads anybody else's shard.
+
+    Saving a user locks only that user's shard; the index is locked only
+    while a user is registered. Registrations also update a Bloom filter
+    of the usernames, ``usernames.bloom``, so that checking whether a
+    name is free usually reads neither the index nor any shard.
+
+    The index is read again whenever another session replaced it, and an
+    entry only enters it once the user's shard has been written.
+    """
+
+    INDEX_FILE = 'index.json'
+    FILTER_FILE = 'usernames.bloom'
+    SHARD_SUFFIX = '.json'
+
+    def __init__(self, directory, legacy_file=None):
+        """Create a store rooted at a directory.
+
+        Args:
+            directory (str): The directory holding the index and shards.
+            legacy_file (str): An optional single-file users.json that is
+                split into shards the first time the store is used.
+        """
+        self.directory = directory
+        self.legacy_file = legacy_file
+        self.index = None
+        self.index_stat = None
+        self.names = None
+        self.names_stat = None
+
+    def _index_path(self):
+        return os.path.join(self.directory, self.INDEX_FILE)
+
+    def _filter_path(self):
+        return os.path.join(self.directory, self.FILTER_FILE)
+
+    def _shard_path(self, shard):
+        return os.path.join(self.directory, shard)
+
+    @classmethod
+    def _shard_name(cls, username):
+        """Return a filesystem-safe shard name for a username."""
+        digest = hashlib.sha1(username.encode('utf-8')).hexdigest()
+        return f'{digest}{cls.SHARD_SUFFIX}'
+
+    def _read_shard(self, shard):
+        """Load the user stored in a shard file."""
+        with open(self._shard_path(shard), 'r') as file:
+            return json.load(file)
+
+    def _encode(self, user_data):
+        """Return what ``write_files`` writes to a user's shard."""
+        return user_data
+
+    def _index_key(self):
+        """Return what identifies the index file's content on disk."""
+        try:
+            stat = os.stat(self._index_path())
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _load_index(self):
+        """Load the username index, migrating the legacy file if needed.
+
+        The index is only read again when its file was replaced since it
+        was last read or written by this store.
+
+        Returns:
+            dict: A mapping of usernames to their ``shard`` file name and
+                ``password`` hash.
+        """
+        key = self._index_key()
+        if self.index is not None and key == self.index_stat:
+            return self.index
+        if key is not None:
+            with open(self._index_path(), 'r') as file:
+                self.index = json.load(file)
+            self.index_stat = key
+        elif self.legacy_file and os.path.exists(self.legacy_file):
+            self.index = {}
+            for batch in iter_batches(iter_users(self.legacy_file)):
+                self._write_shards(batch)
+            self._save_index()
+        else:
+            self.index = {}
+        return self.index
+
+    @staticmethod
+    def _entry(shard, user_data):
+        return {'shard': shard, 'password': user_data['password']}
+
+    def _save_index(self):
+        self.names = UsernameFilter.build(self.index)
+        write_files({
+            self._index_path(): self.index,
+            self._filter_path(): self.names.to_bytes()
+        })
+        self.index_stat = self._index_key()
+
+    def _load_filter(self):
+        """Return the stored username filter, or None if there is none.
+
+        The filter is read again only when another session replaced it.
+        """
+        try:
+            stat = os.stat(self._filter_path())
+        except FileNotFoundError:
+            return None
+        key = (stat.st_mtime_ns, stat.st_size)
+        if key != self.names_stat:
+            with open(self._filter_path(), 'rb') as file:
+                data = file.read()
+            try:
+                self.names = UsernameFilter.from_bytes(data)
+            except (ValueError, struct.error):
+                return None
+            self.names_stat = key
+        return self.names
+
+    def username_taken(self, username):
+        """Check the Bloom filter, and confirm a hit against the index."""
+        names = self._load_filter()
+        if names is not None and username not in names:
+            return False
+        return username in self._load_index()
+
+    def load_users(self):
+        """Load every user from their shards.
+
+        Returns:
+            dict: A dictionary containing user data keyed by username.
+        """
+        users = {}
+        for username, entry in self._load_index().items():
+            users[username] = self._read_shard(entry['shard'])
+        return users
+
+    def load_user(self, username):
+        """Load a single user from their shard.
+
+        Returns:
+            dict: The user's data, or None if the user does not exist.
+        """
+        entry = self._load_index().get(username)
+        if entry is None:
+            return None
+        return dict({'version': 0}, **self._read_shard(entry['shard']))
+
+    def load_credentials(self):
+        """Load the password hashes from the index alone.
+
+        The index is read again if another session replaced it, so users
+        registered elsewhere are seen without restarting.
+
+        Returns:
+            dict: A mapping of usernames to bcrypt password hashes.
+        """
+        return {
+            username: entry['password']
+            for username, entry in self._load_index().items()
+        }
+
+    def save_user(self, username, user_data, change=None):
+        """Rewrite the shard of a single user.
+
+        The index is only rewritten when the user is new.
+
+        Args:
+            username (str): The user whose data changed.
+            user_data (dict): The user's password hash and tasks.
+            change (dict): The mutation that was made. Snapshot shards
+                ignore it and always store the whole user.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        entry = self._load_index().get(username)
+        if entry is None:
+            with file_lock(f'{self._index_path()}.lock'):
+                entry = self._load_index().get(username)
+                if entry is None:
+                    user_data['version'] = next_version(
+                        username, user_data, None
+                    )
+                    self._write_shards(
+                        {username: user_data}, with_index=True
+                    )
+                    return
+        shard = entry['shard']
+        path = self._shard_path(shard)
+        with file_lock(f'{path}.lock'):
+            current = stored_version(self._read_shard(shard))
+            user_data['version'] = next_version(username, user_data, current)
+            write_files({path: self._encode(user_data)})
+
+    def save_users(self, users):
+        """Rewrite the shards of every given user.
+
+        Args:
+            users (dict): A dictionary containing user data to be saved.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with file_lock(f'{self._index_path()}.lock'):
+            self._load_index()
+            self._write_shards(users, with_index=True)
+
+    def _write_shards(self, users, with_index=False):
+        """Write shards and their index entries in one batch.
+
+        The new entries replace ``self.index`` only after the files were
+        written, so a reader never finds an entry without its shard.
+
+        Args:
+            users (dict): A dictionary containing user data to be saved.
+            with_index (bool): Whether to rewrite the index file in the
+                same batch; the caller then holds the index lock.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        files = {}
+        index = dict(self.index)
+        added = [username for username in users if username not in index]
+        for username, user_data in users.items():
+            entry = index[username] = self._entry(
+                self._shard_name(username), user_data
+            )
+            files[self._shard_path(entry['shard'])] = self._encode(user_data)
+        if with_index:
+            files[self._index_path()] = index
+            names = self._load_filter()
+            if names is None or names.count + len(added) > names.capacity:
+                names = UsernameFilter.build(index)
+            else:
+                for username in added:
+                    names.add(username)
+            files[self._filter_path()] = names.to_bytes()
+        write_files(files)
+        self.index = index
+        if with_index:
+            self.index_stat = self._index_key()
+
+
+class BinaryShardedStore(ShardedStore):
+    """A sharded store whose shards use the compact binary task format.
+
+    Each task takes a flags byte, a 4-byte due date and its title instead
+    of a JSON object repeating every key; see ``encode_user``. The index
+    stays JSON, and ``python3 storage.py export`` converts the shards
+    back to a users.json file.
+    """
+
+    SHARD_SUFFIX = '.tasks'
+
+    def _read_shard(self, shard):
+        with open(self._shard_path(shard), 'rb') as file:
+            return decode_user(file.read())
+
+    def _encode(self, user_data):
+        return encode_user(user_data)
+
+
+class JournalStore(Store):
+    """Append task mutations to a journal in front of a snapshot store.
+
+    Every change is written as one JSON line to the journal instead of
+    rewriting the snapshot. Loading replays the journal on top of the
+    snapshot, and once the journal grows past ``COMPACT_SIZE`` bytes a
+    background thread folds it into the snapshot.
+
+    Every record carries the user's new ``version``. The version check of
+    a save scans the journal for the user's last record, which is cheap
+    because compaction keeps the journal small.
+
+    Compaction first seals the journal by renaming it to ``<path>.<id>``.
+    Each folded user records the id in ``compacted`` so that a sealed
+    journal left behind by an interrupted compaction is never applied to
+    the same user twice.
+
+    The compactor thread shares the snapshot store with the session, so
+    every use of the snapshot, and every load that replays the journals
+    on top of it, holds ``snapshot_lock``. The thread is not a daemon:
+    exiting waits for a running compaction to finish.
+    """
+
+    COMPACT_SIZE = 64 * 1024
+
+    def __init__(self, snapshot, path):
+        """Create a journal in front of a snapshot store.
+
+        Args:
+            snapshot: The store that compacted users are written to.
+            path (str): The journal file. Its directory should hold
+                nothing else, as it is listed for sealed journals.
+        """
+        self.snapshot = snapshot
+        self.snapshot_lock = threading.RLock()
+        self.path = path
+        self._compactor = None
+
+    @contextmanager
+    def _locked(self, suffix, blocking=True):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with file_lock(f'{self.path}.{suffix}', blocking) as acquired:
+            yield acquired
+
+    def _sealed(self):
+        """Return the sealed journals as (id, path) pairs, oldest first."""
+        directory = os.path.dirname(self.path) or '.'
+        prefix = os.path.basename(self.path) + '.'
+        if not os.path.isdir(directory):
+            return []
+        sealed = []
+        for name in os.listdir(directory):
+            suffix = name[len(prefix):]
+            if name.startswith(prefix) and suffix.isdigit():
+                sealed.append((int(suffix), os.path.join(directory, name)))
+        return sorted(sealed)
+
+    @staticmethod
+    def _lines(path):
+        """Yield the complete lines of a journal file."""
+        try:
+            file = open(path, 'r')
+        except FileNotFoundError:
+            # Not written yet, or removed by a finished compaction
+            return
+        with file:
+            for line in file:
+                # A torn last line means the writer died mid-append
+                if line.endswith('\n'):
+                    yield line
+
+    @classmethod
+    def _records(cls, path):
+        """Yield the complete records of a journal file."""
+        for line in cls._lines(path):
+            yield json.loads(line)
+
+    def _current_version(self, username):
+        """Return a user's latest version, or None if there is no user.
+
+        Records start with the user's name, so only the user's last line
+        is decoded. The caller holds the journal lock.
+        """
+        prefix = '{"user":' + json.dumps(username) + ','
+        paths = [self.path]
+        paths += [path for sealed_id, path in reversed(self._sealed())]
+        for path in paths:
+            last = None
+            for line in self._lines(path):
+                if line.startswith(prefix):
+                    last = line
+            if last is not None:
+                return json.loads(last).get('version', 0)
+        with self.snapshot_lock:
+            return stored_version(self.snapshot.load_user(username))
+
+    def username_taken(self, username):
+        """Look for the user in the journals, then ask the snapshot."""
+        prefix = '{"user":' + json.dumps(username) + ','
+        paths = [path for sealed_id, path in self._sealed()] + [self.path]
+        for path in paths:
+            if any(line.startswith(prefix) for line in self._lines(path)):
+                return True
+        with self.snapshot_lock:
+            return self.snapshot.username_taken(username)
+
+    def _replay(self, users, sealed_id, path, username=None):
+        """Apply a journal to ``users``, skipping already folded users.
+
+        Args:
+            users (dict): A dictionary containing user data, updated in
+                place.
+            sealed_id (int): The id of a sealed journal, or None for the
+                live journal.
+            path (str): The journal file to replay.
+            username (str): Only replay the records of this user.
+        """
+        folded = {
+            name for name, user_data in users.items()
+            if sealed_id is not None
+            and user_data.get('compacted', 0) >= sealed_id
+        }
+        for record in self._records(path):
+            if username is not None and record['user'] != username:
+                continue
+            if record['user'] not in folded:
+                apply_change(users, record)
+
+    def load_users(self):
+        """Load the snapshot and replay the journal on top of it.
+
+        Returns:
+            dict: A dictionary containing user data keyed by username.
+        """
+        with self.snapshot_lock:
+            users = self.snapshot.load_users()
+            for sealed_id, path in self._sealed():
+                self._replay(users, sealed_id, path)
+            self._replay(users, None, self.path)
+        return users
+
+    def load_user(self, username):
+        """Load a single user with their journaled changes applied.
+
+        Returns:
+            dict: The user's data, or None if the user does not exist.
+        """
+        users = {}
+        with self.snapshot_lock:
+            user_data = self.snapshot.load_user(username)
+            if user_data is not None:
+                users[username] = user_data
+            for sealed_id, path in self._sealed():
+                self._replay(users, sealed_id, path, username)
+            self._replay(users, None, self.path, username)
+        user_data = users.get(username)
+        if user_data is not None:
+            user_data.setdefault('version', 0)
+        return user_data
+
+    def load_credentials(self):
+        """Load the snapshot's password hashes plus journaled users.
+
+        Returns:
+            dict: A mapping of usernames to bcrypt password hashes.
+        """
+        with self.snapshot_lock:
+            credentials = self.snapshot.load_credentials()
+            paths = [path for sealed_id, path in self._sealed()]
+            for path in paths + [self.path]:
+                for record in self._records(path):
+                    if record['op'] == 'user':
+                        credentials[record['user']] = (
+                            record['data']['password']
+                        )
+        return credentials
+
+    def _drop_torn_tail(self):
+        """Cut a torn last line off the journal; the caller holds the lock.
+
+        Readers skip such a line, but a record appended after it would
+        share its line and make the journal unreadable.
+        """
+        try:
+            file = open(self.path, 'r+b')
+        except FileNotFoundError:
+            return
+        with file:
+            end = position = file.seek(0, os.SEEK_END)
+            if end == 0:
+                return
+            file.seek(end - 1)
+            if file.read(1) == b'\n':
+                return
+            keep = 0
+            while position > 0:
+                start = max(position - 4096, 0)
+                file.seek(start)
+                newline = file.read(position - start).rfind(b'\n')
+                if newline != -1:
+                    keep = start + newline + 1
+                    break
+                position = start
+            if keep != end:
+                file.truncate(keep)
+
+    def _append(self, records):
+        """Append records to the journal; the caller holds the lock.
+
+        Returns:
+            int: The size of the journal afterwards.
+        """
+        lines = ''.join(
+            json.dumps(record, separators=(',', ':')) + '\n'
+            for record in records
+        )
+        self._drop_torn_tail()
+        with open(self.path, 'a') as file:
+            file.write(lines)
+            file.flush()
+            os.fsync(file.fileno())
+        return os.path.getsize(self.path)
+
+    def save_user(self, username, user_data, change=None):
+        """Append a user's mutation to the journal.
+
+        Args:
+            username (str): The user whose data changed.
+            user_data (dict): The user's data, journaled in full when no
+                change is given (e.g. on registration).
+            change (dict): The mutation that was made, e.g.
+                ``{'op': 'add', 'task': {...}}``.
+
+        Raises:
+            ConflictError: If the user was saved by another session since
+                ``user_data`` was loaded.
+        """
+        if change is None:
+            change = {'op': 'user', 'data': user_data}
+        with self._locked('lock'):
+            version = next_version(
+                username, user_data, self._current_version(username)
+            )
+            user_data['version'] = version
+            size = self._append(
+                [{'user': username, **change, 'version': version}]
+            )
+        if size >= self.COMPACT_SIZE:
+            self.compact_in_background()
+
+    def save_users(self, users):
+        """Journal the full data of every given user.
+
+        Args:
+            users (dict): A dictionary containing user data to be saved.
+        """
+        with self._locked('lock'):
+            size = self._append(
+                {
+                    'user': username, 'op': 'user', 'data': user_data,
+                    'version': user_data.get('version', 0)
+                }
+                for username, user_data in users.items()
+            )
+        if size >= self.COMPACT_SIZE:
+            self.compact_in_background()
+
+    def compact(self):
+        """Fold the journal into the snapshot store.
+
+        Only the users that appear in the journal are rewritten. If another
+        process is already compacting, this returns without doing anything.
+        """
+        with self._locked('compact', blocking=False) as acquired:
+            if not acquired:
+                return
+            # Sessions in this process read the snapshot and journals
+            # under snapshot_lock, so none sees the journal being sealed
+            with self._locked('lock'), self.snapshot_lock:
+                if os.path.exists(self.path) and os.path.getsize(self.path):
+                    os.rename(self.path, f'{self.path}.{time.time_ns()}')
+            for sealed_id, path in self._sealed():
+                users = {}
+                with self.snapshot_lock:
+                    for record in self._records(path):
+                        username = record['user']
+                        if username not in users:
+                            user_data = self.snapshot.load_user(username)
+                            if user_data is not None:
+                                users[username] = user_data
+                self._replay(users, sealed_id, path)
+                folded = {}
+                for username, user_data in users.items():
+                    if user_data.get('compacted', 0) < sealed_id:
+                        user_data['compacted'] = sealed_id
+                        folded[username] = user_data
+                with self.snapshot_lock:
+                    self.snapshot.save_users(folded)
+                    os.remove(path)
+
+    def close(self):
+        """Wait for a running background compaction to finish."""
+        if self._compactor is not None:
+            self._compactor.join()
+
+    def compact_in_background(self):
+        """Start compacting in a thread unless one is running."""
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        self._compactor = threading.Thread(target=self.compact)
+        self._compactor.start()
+
+
+class SQLiteStore(Store):
+    """Store users and their tasks as rows of an SQLite database.
+
+    Every change is applied row by row, finding the task it refers to
+    through the index on its ``id``. A task's ``position`` is its place
+    in the user's list, and ``day`` is the day it sorts on by due date
+    (see ``due_day``).
+
+    The priority, keyword, due date and done count queries run inside
+    SQLite, using the indexes on the tasks table.
+    """
+
+    INDEXED_QUERIES = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            password TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS tasks (
+            username TEXT NOT NULL REFERENCES users (username),
+            position INTEGER NOT NULL,
+            task TEXT NOT NULL,
+            priority TEXT NOT NULL,
+            due_date TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            done INTEGER NOT NULL DEFAULT 0,
+            id INTEGER,
+            PRIMARY KEY (username, position)
+        );
+        CREATE INDEX IF NOT EXISTS tasks_id ON tasks (username, id);
+        CREATE INDEX IF NOT EXISTS tasks_priority
+            ON tasks (username, priority, position);
+        CREATE INDEX IF NOT EXISTS tasks_due_date
+            ON tasks (username, day, id);
+        CREATE INDEX IF NOT EXISTS tasks_done ON tasks (username, done);
+    """
+
+    COLUMNS = 'task, priority, due_date, done, id'
+    ROW_COLUMNS = 'task, priority, due_date, day, done, id'
+
+    def __init__(self, path, legacy_file=None):
+        """Open, and if needed create, an SQLite database.
+
+        Args:
+            path (str): The database file.
+            legacy_file (str): An optional single-file users.json that is
+                imported the first time the database is created.
+        """
+        import sqlite3
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        # Match Python's str.lower() rather than SQLite's ASCII-only lower()
+        self.connection.create_function(
+            'py_lower', 1, str.lower, deterministic=True
+        )
+        with self.connection:
+            self.connection.executescript(self.SCHEMA)
+        empty = self.connection.execute(
+            'SELECT NOT EXISTS (SELECT 1 FROM users)'
+        ).fetchone()[0]
+        if empty and legacy_file and os.path.exists(legacy_file):
+            for batch in iter_batches(iter_users(legacy_file)):
+                self.save_users(batch)
+
+    @staticmethod
+    def _task(row):
+        task, priority, due_date, done, task_id = row
+        task = {
+            'task': task,
+            'priority': priority,
+            'due_date': due_date,
+            'done': bool(done)
+        }
+        if task_id is not None:
+            task['id'] = task_id
+        return task
+
+    @staticmethod
+    def _row(task):
+        """Return a task's values for the columns of ``ROW_COLUMNS``."""
+        due_date = task.get('due_date', 'N/A')
+        return (
+            task['task'], task['priority'], due_date, due_day(due_date),
+            int(bool(task.get('done'))), task.get('id')
+        )
+
+    def _position(self, username, change):
+        """Return the position of the row a change refers to."""
+        row = self.connection.execute(
+            'SELECT position FROM tasks WHERE username = ? AND id = ?',
+            (username, change['id'])
+        ).fetchone()
+        if row is None:
+            raise ValueError(f"No task with id {change['id']}")
+        return row[0]
+
+    def _select(self, where, params):
+        rows = self.connection.execute(
+            f'SELECT {self.COLUMNS} FROM tasks WHERE {where} '
+            'ORDER BY position',
+            params
+        )
+        return [self._task(row) for row in rows]
+
+    def close(self):
+        self.connection.close()
+
+    def load_users(self):
+        """Load every user and their tasks.
+
+        Returns:
+            dict: A dictionary containing user data keyed by username.
+        """
+        users = {
+            username: {'password': password, 'tasks': []}
+            for username, password in self.connection.execute(
+                'SELECT username, password FROM users'
+            )
+        }
+        rows = self.connection.execute(
+            f'SELECT username, {self.COLUMNS} FROM tasks '
+            'ORDER BY username, position'
+        )
+        for username, *row in rows:
+            users[username]['tasks'].append(self._task(row))
+        return users
+
+    def load_user(self, username):
+        """Load a single user and their tasks.
+
+        Returns:
+            dict: The user's data, or None if the user does not exist.
+        """
+        row = self.connection.execute(
+            'SELECT password, version FROM users WHERE username = ?',
+            (username,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            'password': row[0],
+            'tasks': self._select('username = ?', (username,)),
+            'version': row[1]
+        }
+
+    def load_credentials(self):
+        """Load the password hashes without touching the tasks table.
+
+        Returns:
+            dict: A mapping of usernames to bcrypt password hashes.
+        """
+        return dict(self.connection.execute(
+            'SELECT username, password FROM users'
+        ))
+
+    def _replace_user(self, username, user_data):
+        self.connection.execute(
+            'INSERT OR REPLACE INTO users (username, password, version) '
+            'VALUES (?, ?, ?)',
+            (username, user_data['password'], user_data.get('version', 0))
+        )
+        self._replace_tasks(username, user_data)
+
+    def _replace_tasks(self, username, user_data):
+        self.connection.execute(
+            'DELETE FROM tasks WHERE username = ?', (username,)
+        )
+        self.connection.executemany(
+            f'INSERT INTO tasks (username, position, {self.ROW_COLUMNS}) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            [
+                (username, position, *self._row(task))
+                for position, task in enumerate(user_data['tasks'])
+            ]
+        )
+
+    def _apply(self, username, change):
+        """Apply a single change to the rows of one user."""
+        op = change['op']
+        execute = self.connection.execute
+        if op == 'add':
+            execute(
+                f'INSERT INTO tasks (username, position, {self.ROW_COLUMNS}) '
+                'SELECT ?, COUNT(*), ?, ?, ?, ?, ?, ? '
+                'FROM tasks WHERE username = ?',
+                (username, *self._row(change['task']), username)
+            )
+        elif op == 'delete':
+            position = self._position(username, change)
+            execute(
+                'DELETE FROM tasks WHERE username = ? AND position = ?',
+                (username, position)
+            )
+            execute(
+                'UPDATE tasks SET position = position - 1 '
+                'WHERE username = ? AND position > ?',
+                (username, position)
+            )
+        elif op == 'done':
+            execute(
+                'UPDATE tasks SET done = 1 '
+                'WHERE username = ? AND position = ?',
+                (username, self._position(username, change))
+            )
+        elif op == 'edit':
+            execute(
+                'UPDATE tasks SET task = ?, priority = ?, due_date = ?, '
+                'day = ?, done = ?, id = ? '
+                'WHERE username = ? AND position = ?',
+                (
+                    *self._row(change['task']), username,
+                    self._position(username, change)
+                )
+            )
+        else:
+            raise ValueError(f"Unknown change operation '{op}'")
+
+    def save_user(self, username, user_data, change=None):
+        """Apply a user's change to their rows.
+
+        The version check and the change run in one transaction: the
+        user's row is only updated while it still has the version the
+        session loaded.
+
+        Args:
+            username (str): The user whose data changed.
+            user_data (dict): The user's data, rewritten in full when no
+                change is given (e.g. on registration).
+            change (dict): The mutation that was made, e.g.
+                ``{'op': 'add', 'task': {...}}``.
+
+        Raises:
+            ConflictError: If the user was saved by another session since
+                ``user_data`` was loaded.
+        """
+        import sqlite3
+        expected = user_data.get('version')
+        with self.connection:
+            if expected is None:
+                try:
+                    self.connection.execute(
+                        'INSERT INTO users (username, password, version) '
+                        'VALUES (?, ?, 1)',
+                        (username, user_data['password'])
+                    )
+                except sqlite3.IntegrityError:
+                    raise ConflictError(username)
+                self._replace_tasks(username, user_data)
+            else:
+                cursor = self.connection.execute(
+                    'UPDATE users SET version = version + 1 '
+                    'WHERE username = ? AND version = ?',
+                    (username, expected)
+                )
+                if cursor.rowcount == 0:
+                    raise ConflictError(username)
+                if change is None or change['op'] == 'user':
+                    self._replace_tasks(username, user_data)
+                else:
+                    self._apply(username, change)
+        user_data['version'] = (expected or 0) + 1
+
+    def save_users(self, users):
+        """Rewrite the rows of every given user.
+
+        Args:
+            users (dict): A dictionary containing user data to be saved.
+        """
+        with self.connection:
+            for username, user_data in users.items():
+                self._replace_user(username, user_data)
+
+    def _ids(self, where, params, order):
+        rows = self.connection.execute(
+            f'SELECT id FROM tasks WHERE username = ? AND {where} '
+            f'ORDER BY {order}',
+            params
+        )
+        return [task_id for task_id, in rows]
+
+    def task_ids_with_priority(self, username, priority):
+        return self._ids('priority = ?', (username, priority), 'position')
+
+    def task_ids_matching(self, username, keyword):
+        return self._ids(
+            'instr(py_lower(task), ?) > 0', (username, keyword.lower()),
+            'position'
+        )
+
+    def task_ids_by_due_date(self, username):
+        return self._ids('1', (username,), 'day, id')
+
+    def count_done(self, username):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM tasks WHERE username = ? AND done = 1',
+            (username,)
+        ).fetchone()[0]
+
+
+class DbmStore(Store):
+    """Store every user as one JSON value in a dbm key-value database.
+
+    The database is opened for each operation, so that sessions in other
+    processes are never locked out by a long-lived handle. Reads hold
+    ``<path>.lock`` as well as writes, because ``dbm.dumb`` rewrites its
+    ``.dir`` file in place and a reader could see it half written.
+    """
+
+    def __init__(self, path, legacy_file=None):
+        """Create a store backed by a dbm database.
+
+        Args:
+            path (str): The database file, without any dbm suffix.
+            legacy_file (str): An optional single-file users.json that is
+                imported the first time the database is created.
+        """
+        self.path = path
+        with self._locked():
+            created = dbm.whichdb(path) is None
+            if created:
+                with dbm.open(path, 'c'):
+                    pass
+        if created and legacy_file and os.path.exists(legacy_file):
+            for batch in iter_batches(iter_users(legacy_file)):
+                self.save_users(batch)
+
+    def _locked(self):
+        return file_lock(f'{self.path}.lock')
+
+    def _get(self, username):
+        """Load a user without taking the lock; the caller holds it."""
+        with dbm.open(self.path, 'r') as db:
+            value = db.get(username.encode('utf-8'))
+        if value is None:
+            return None
+        return dict({'version': 0}, **json.loads(value))
+
+    def _put(self, users):
+        """Write users without taking the lock; the caller holds it."""
+        with dbm.open(self.path, 'w') as db:
+            for username, user_data in users.items():
+                db[username.encode('utf-8')] = json.dumps(user_data)
+
+    def load_users(self):
+        with self._locked(), dbm.open(self.path, 'r') as db:
+            return {
+                key.decode('utf-8'): json.loads(db[key])
+                for key in db.keys()
+            }
+
+    def load_user(self, username):
+        with self._locked():
+            return self._get(username)
+
+    def save_user(self, username, user_data, change=None):
+        with self._locked():
+            version = next_version(
+                username, user_data, stored_version(self._get(username))
+            )
+            user_data['version'] = version
+            self._put({username: user_data})
+
+    def save_users(self, users):
+        with self._locked():
+            self._put(users)
+
+
+class RemoteStore(Store):
+    """Forward every storage call to the storage_server.py daemon.
+
+    The daemon holds all users in memory and owns the files on disk, so a
+    session neither parses the data set at startup nor writes to it
+    directly. Calls are JSON lines over a Unix domain socket.
+    """
+
+    def __init__(self, path):
+        """Connect to a running storage daemon.
+
+        Args:
+            path (str): The daemon's Unix domain socket.
+        """
+        import socket
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.connection.connect(path)
+        self.file = self.connection.makefile('rwb')
+
+    def _call(self, method, *args):
+        """Send one request to the daemon and wait for its response.
+
+        Raises:
+            ConflictError: If the daemon refused a save.
+            IOError: If the daemon failed to handle the request.
+        """
+        request = json.dumps({'method': method, 'args': args})
+        with self.lock:
+            self.file.write(request.encode('utf-8') + b'\n')
+            self.file.flush()
+            line = self.file.readline()
+        if not line:
+            raise IOError('The storage daemon closed the connection')
+        response = json.loads(line)
+        if response.get('error') == 'conflict':
+            raise ConflictError(response['user'])
+        if 'error' in response:
+            raise IOError(response['message'])
+        return response['result']
+
+    def load_users(self):
+        return self._call('load_users')
+
+    def load_user(self, username):
+        return self._call('load_user', username)
+
+    def load_credentials(self):
+        return self._call('load_credentials')
+
+    def save_user(self, username, user_data, change=None):
+        user_data['version'] = self._call(
+            'save_user', username, user_data, change
+        )
+
+    def save_users(self, users):
+        self._call('save_users', users)
+
+    def close(self):
+        self.file.close()
+        self.connection.close()
+
+
+class CoalescingStore(Store):
+    """Hold back task changes and write bursts of them as one save.
+
+    Saves of a user's task changes are only recorded as dirty. They are
+    written once ``max_changes`` of them are pending or the oldest has
+    waited ``max_delay`` seconds, and whenever ``flush`` or ``close`` is
+    called. A single pending change is passed on as is; several are
+    written as one full save of the user, so the backend sees one write
+    and one version bump per burst.
+
+    Registrations are written at once, since the username must be
+    checked before the user is told it is theirs. A conflict is only
+    found when the changes are written; the held back changes are then
+    dropped and ``ConflictError`` is raised from that save or flush.
+
+    Task queries are only passed on to a backend with indexed queries,
+    after writing the user's held back changes so that the backend
+    answers for the tasks the session has.
+    """
+
+    def __init__(self, store, max_changes=10, max_delay=2.0):
+        """Wrap a backend.
+
+        Args:
+            store (Store): The backend that changes are written to.
+            max_changes (int): How many changes of a user to hold back.
+            max_delay (float): How many seconds a change may be held back
+                before the next save writes it.
+        """
+        self.store = store
+        self.max_changes = max_changes
+        self.max_delay = max_delay
+        # username -> [user_data, changes, time of the oldest change]
+        self.pending = {}
+
+    def load_users(self):
+        self.flush()
+        return self.store.load_users()
+
+    def load_user(self, username):
+        self.flush(username)
+        return self.store.load_user(username)
+
+    def load_credentials(self):
+        return self.store.load_credentials()
+
+    def username_taken(self, username):
+        return self.store.username_taken(username)
+
+    def save_user(self, username, user_data, change=None):
+        entry = self.pending.get(username)
+        if change is None or (entry and entry[0] is not user_data):
+            self.flush(username)
+            entry = None
+        if change is None:
+            self._save(username, user_data)
+            return
+        if entry is None:
+            entry = self.pending[username] = [
+                user_data, [], time.monotonic()
+            ]
+        entry[1].append(change)
+        if (len(entry[1]) >= self.max_changes
+                or time.monotonic() - entry[2] >= self.max_delay):
+            self.flush()
+
+    def save_users(self, users):
+        for username in users:
+            self.pending.pop(username, None)
+        self.store.save_users(users)
+
+    def flush(self, username=None):
+        """Write the held back changes of one user, or of every user.
+
+        Raises:
+            ConflictError: If a user was saved by another session since
+                they were loaded. Their held back changes are dropped.
+        """
+        if username is None:
+            usernames = list(self.pending)
+        else:
+            usernames = [username] if username in self.pending else []
+        conflict = None
+        for name in usernames:
+            user_data, changes, since = self.pending.pop(name)
+            try:
+                self._save(
+                    name, user_data, changes[0] if len(changes) == 1 else None
+                )
+            except ConflictError as error:
+                conflict = conflict or error
+        if conflict is not None:
+            raise conflict
+
+    def _save(self, username, user_data, change=None):
+        """Save a user whose tasks may be held in a session structure.
+
+        Sessions may keep their tasks in something other than a list,
+        such as ``tasklist.TaskList``; it is turned into the stored list
+        with its ``to_dicts`` method.
+        """
+        stored = user_data
+        if not isinstance(user_data['tasks'], list):
+            stored = dict(user_data, tasks=user_data['tasks'].to_dicts())
+        self.store.save_user(username, stored, change)
+        user_data['version'] = stored['version']
+
+    def close(self):
+        """Write the held back changes and close the backend.
+
+        Changes that conflict with another session's are dropped.
+        """
+        try:
+            self.flush()
+        except ConflictError:
+            pass
+        self.store.close()
+
+    def _query(self, method, username, *args):
+        if not self.store.INDEXED_QUERIES:
+            return None
+        self.flush(username)
+        return getattr(self.store, method)(username, *args)
+
+    def task_ids_with_priority(self, username, priority):
+        return self._query('task_ids_with_priority', username, priority)
+
+    def task_ids_matching(self, username, keyword):
+        return self._query('task_ids_matching', username, keyword)
+
+    def task_ids_by_due_date(self, username):
+        return self._query('task_ids_by_due_date', username)
+
+    def count_done(self, username):
+        return self._query('count_done', username)
+
+
+BACKENDS = (
+    'journal', 'sharded', 'binary', 'json', 'sqlite', 'dbm', 'memory'
+)
+
+SOCKET_FILE = 'storage.sock'
+
+
+def open_store(backend, directory='.', legacy_file=None):
+    """Create one of the storage backends by name.
+
+    Args:
+        backend (str): One of ``BACKENDS``, or 'remote' to use a running
+            storage_server.py daemon. 'journal' is the sharded store with
+            the mutation journal in front of it.
+        directory (str): The directory the backend keeps its files in.
+        legacy_file (str): An optional single-file users.json that new
+            stores are populated from.
+
+    Returns:
+        Store: The storage backend.
+
+    Raises:
+        ValueError: If the backend name is unknown.
+    """
+    shards = os.path.join(directory, 'users')
+    if backend == 'journal':
+        return JournalStore(
+            ShardedStore(shards, legacy_file=legacy_file),
+            # Not next to the shards: every load and save lists the
+            # journal's directory for sealed journals
+            os.path.join(directory, 'journal', 'journal.log')
+        )
+    if backend == 'sharded':
+        return ShardedStore(shards, legacy_file=legacy_file)
+    if backend == 'binary':
+        return BinaryShardedStore(
+            os.path.join(directory, 'tasks'), legacy_file=legacy_file
+        )
+    if backend == 'json':
+        return JsonFileStore(
+            legacy_file or os.path.join(directory, 'users.json')
+        )
+    if backend == 'sqlite':
+        return SQLiteStore(
+            os.path.join(directory, 'users.db'), legacy_file=legacy_file
+        )
+    if backend == 'dbm':
+        return DbmStore(
+            os.path.join(directory, 'users.dbm'), legacy_file=legacy_file
+        )
+    if backend == 'memory':
+        return MemoryStore(legacy_file=legacy_file)
+    if backend == 'remote':
+        return RemoteStore(os.path.join(directory, SOCKET_FILE))
+    raise ValueError(f"Unknown storage backend '{backend}'")
+
+
+def main():
+    """Export a backend's users to a users.json file, or import them.
+
+    Usage::
+
+        python3 storage.py export BACKEND FILE
+        python3 storage.py import BACKEND FILE
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Convert between a storage backend and users.json.'
+    )
+    parser.add_argument('command', choices=['export', 'import'])
+    parser.add_argument('backend', choices=BACKENDS + ('remote',))
+    parser.add_argument('file', help='The users.json file')
+    parser.add_argument('--directory', default='.')
+    args = parser.parse_args()
+
+    store = open_store(args.backend, directory=args.directory)
+    try:
+        if args.command == 'export':
+            write_files({args.file: store.load_users()})
+        else:
+            for batch in iter_batches(iter_users(args.file)):
+                store.save_users(batch)
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import argparse
+import json
+import os
+import signal
+import socketserver
+import sys
+import threading
+import time
+from storage import (
+    BACKENDS, SOCKET_FILE, ConflictError, next_version, open_store,
+    stored_version
+)
+
+
+class StorageService:
+    """Hold every user in memory and group-commit changes to a backend.
+
+    Saves are checked and applied in memory under one lock, which
+    serializes writes from all sessions. A committer thread then writes
+    every user changed since the last commit to the backend in a single
+    ``save_users`` call, and each save returns once its commit is done.
+    """
+
+    # How long the committer waits for more saves to join a commit
+    COMMIT_DELAY = 0.005
+    RETRY_DELAY = 1.0
+
+    def __init__(self, backend):
+        """Load every user from a backend and start the committer.
+
+        Args:
+            backend (Store): The store that commits are written to.
+        """
+        self.backend = backend
+        self.users = backend.load_users()
+        for user_data in self.users.values():
+            user_data.setdefault('version', 0)
+        self.lock = threading.Condition()
+        self.dirty = {}
+        self.next_commit = 1
+        self.committed = 0
+        self.closed = False
+        self.committer = threading.Thread(target=self._commit_loop)
+        self.committer.start()
+
+    def _commit_loop(self):
+        while True:
+            with self.lock:
+                while not self.dirty and not self.closed:
+                    self.lock.wait()
+                if not self.dirty:
+                    return
+            time.sleep(self.COMMIT_DELAY)
+            with self.lock:
+                batch, self.dirty = self.dirty, {}
+                commit = self.next_commit
+                self.next_commit += 1
+            try:
+                self.backend.save_users(batch)
+            except Exception as error:
+                print(f'Commit failed, retrying: {error}', file=sys.stderr)
+                with self.lock:
+                    self.dirty = dict(batch, **self.dirty)
+                time.sleep(self.RETRY_DELAY)
+                continue
+            with self.lock:
+                self.committed = commit
+                self.lock.notify_all()
+
+    def _wait_for_commit(self):
+        """Wait until the current changes are on disk; hold the lock."""
+        commit = self.next_commit
+        self.lock.notify_all()
+        while self.committed < commit:
+            self.lock.wait()
+
+    def load_users(self):
+        with self.lock:
+            return dict(self.users)
+
+    def load_user(self, username):
+        with self.lock:
+            return self.users.get(username)
+
+    def load_credentials(self):
+        with self.lock:
+            return {
+                username: user_data['password']
+                for username, user_data in self.users.items()
+            }
+
+    def save_user(self, username, user_data, change=None):
+        """Check and apply a save, then wait for it to be committed.
+
+        The change itself is not needed: the whole user is committed, so
+        several changes to one user in a commit cost a single write.
+
+        Returns:
+            int: The user's new version.
+
+        Raises:
+            ConflictError: If the user was saved by another session since
+                ``user_data`` was loaded.
+        """
+        with self.lock:
+            current = stored_version(self.users.get(username))
+            user_data['version'] = next_version(username, user_data, current)
+            self.users[username] = self.dirty[username] = user_data
+            self._wait_for_commit()
+        return user_data['version']
+
+    def save_users(self, users):
+        with self.lock:
+            self.users.update(users)
+            self.dirty.update(users)
+            self._wait_for_commit()
+
+    def close(self):
+        """Commit any pending changes and close the backend."""
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+        self.committer.join()
+        self.backend.close()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Answer the JSON line requests of one session."""
+
+    METHODS = (
+        'load_users', 'load_user', 'load_credentials', 'save_user',
+        'save_users'
+    )
+
+    def handle(self):
+        service = self.server.service
+        for line in self.rfile:
+            request = json.loads(line)
+            try:
+                if request['method'] not in self.METHODS:
+                    raise ValueError(f"Unknown method '{request['method']}'")
+                method = getattr(service, request['method'])
+                response = {'result': method(*request['args'])}
+            except ConflictError as error:
+                response = {'error': 'conflict', 'user': str(error)}
+            except Exception as error:
+                response = {'error': 'failed', 'message': str(error)}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+class StorageServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, service):
+        self.service = service
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, RequestHandler)
+
+
+def main():
+    """Serve a storage backend to the terminal sessions.
+
+    Start it before the web server and run the sessions with
+    TODO_STORAGE=remote, e.g.::
+
+        python3 storage_server.py --backend journal &
+        TODO_STORAGE=remote node index.js
+    """
+    parser = argparse.ArgumentParser(
+        description='Serve a storage backend over a Unix domain socket.'
+    )
+    parser.add_argument('--backend', choices=BACKENDS, default='journal')
+    parser.add_argument('--directory', default='.')
+    parser.add_argument('--legacy-file', default='users.json')
+    args = parser.parse_args()
+
+    service = StorageService(open_store(
+        args.backend, directory=args.directory,
+        legacy_file=args.legacy_file
+    ))
+    path = os.path.join(args.directory, SOCKET_FILE)
+    server = StorageServer(path, service)
+
+    def stop(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
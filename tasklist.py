@@ -0,0 +1,485 @@
+import sys
+from bisect import bisect_left, insort
+from datetime import date
+from search import TitleIndex, parse_query
+from storage import NO_DUE_DATE, TASK_KEYS, parse_due_date
+
+# Ranked search multiplies a task's relevance by its priority's boost,
+# and by up to 1 + DUE_BOOST for undone tasks as their due date nears
+PRIORITY_BOOSTS = {'High': 1.5, 'Medium': 1.2, 'Low': 1.0}
+DUE_BOOST = 0.5
+
+# Keys in the due date order are the due day above the 32-bit task ID
+ID_BITS = 32
+ID_MASK = (1 << ID_BITS) - 1
+
+
+class Task:
+    """A single task, with typed fields instead of a dictionary.
+
+    ``due`` is a ``datetime.date``, or None for tasks due 'N/A', and the
+    priority is an interned string, so tasks share one copy of each.
+    ``day`` is the due date's ordinal, parsed once when the date is set,
+    so sorting compares integers. Dates written without zero padding,
+    such as '2024-10-1', are normalized to '2024-10-01'. Keys the
+    application does not know, and due dates that cannot be read at all,
+    are kept in ``extra`` so that ``to_dict`` returns what was stored.
+    """
+
+    __slots__ = ('id', 'title', 'priority', 'due', 'day', 'done', 'extra')
+
+    def __init__(self, title, priority, due=None, done=False, task_id=None):
+        """Create a task.
+
+        Args:
+            title (str): What is to be done.
+            priority (str): 'High', 'Medium' or 'Low'.
+            due (date): The due date, or None if there is none.
+            done (bool): Whether the task is done.
+            task_id (int): The task's stable ID, if it has one yet.
+        """
+        self.id = task_id
+        self.title = title
+        self.priority = sys.intern(priority)
+        self.done = done
+        self.extra = None
+        self.set_due(due)
+
+    # Shared with the storage backends, which sort on the same days
+    parse_due = staticmethod(parse_due_date)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create a task from its stored dictionary."""
+        task = cls(
+            data['task'], data['priority'], done=data.get('done', False),
+            task_id=data.get('id')
+        )
+        due_date = data.get('due_date', 'N/A')
+        try:
+            task.set_due(cls.parse_due(due_date))
+        except (TypeError, ValueError):
+            task.extra = {'due_date': due_date}
+        if not TASK_KEYS.issuperset(data):
+            extra = {
+                key: value for key, value in data.items()
+                if key not in TASK_KEYS
+            }
+            task.extra = dict(task.extra or {}, **extra)
+        return task
+
+    def to_dict(self):
+        """Return the dictionary the storage backends save."""
+        data = {
+            'task': self.title,
+            'priority': self.priority,
+            'due_date': self.due.isoformat() if self.due else 'N/A',
+            'done': self.done
+        }
+        if self.id is not None:
+            data['id'] = self.id
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    @property
+    def due_date(self):
+        """The due date as shown and stored, e.g. '2024-10-15' or 'N/A'."""
+        if self.extra and 'due_date' in self.extra:
+            return self.extra['due_date']
+        return self.due.isoformat() if self.due else 'N/A'
+
+    def set_due(self, due):
+        """Change the due date, dropping any unparsed stored text."""
+        self.due = due
+        self.day = due.toordinal() if due else NO_DUE_DATE
+        if self.extra:
+            self.extra.pop('due_date', None)
+
+
+class TaskList:
+    """A user's tasks, addressed by stable IDs instead of list positions.
+
+    Every task carries an ``id`` that never changes, however the list is
+    sorted or shortened. The tasks are kept in a dictionary keyed by ID,
+    in list order, so looking up, updating or deleting a task does not
+    scan or shift the list. The numbers shown in the last task table are
+    mapped back to IDs with ``task_id``.
+
+    Alongside the list order, in which tasks were added, the tasks are
+    kept in due date order: ``due_order`` is a sorted list of integer
+    keys, the due day shifted above the task ID, so ties fall back to the
+    order tasks were added in. It is sorted once on load and then updated
+    with ``bisect`` on every add, edit and delete, so showing the tasks
+    by due date never sorts them and never changes the list order.
+    Likewise ``search_index`` indexes the words and trigrams of the
+    titles, so a keyword search only checks the tasks that may match. It
+    is built on the first search, since many sessions never search, and
+    then kept up to date. A map of each task's place in the list, for
+    putting query results back in list order, is built the same way.
+    """
+
+    def __init__(self, tasks=()):
+        """Index a list of stored tasks.
+
+        Tasks saved before tasks had IDs are given the next free ones;
+        ``assigned`` is then True and the list should be saved in full so
+        that later changes can refer to them. ``normalized`` is True when
+        a stored due date was rewritten, e.g. '2024-10-1' as
+        '2024-10-01', and the list should likewise be saved.
+
+        Args:
+            tasks (list): The user's tasks, as stored dictionaries.
+        """
+        self.tasks = {}
+        self.numbers = []
+        for task in self._read(tasks):
+            self.tasks[task.id] = task
+        # The due date order key and priority of each task, as it was
+        # last indexed, and the IDs of the tasks with each priority
+        self.indexed = {}
+        self.by_priority = {}
+        for task_id, task in self.tasks.items():
+            self.indexed[task_id] = (self._due_key(task), task.priority)
+            self.by_priority.setdefault(task.priority, set()).add(task_id)
+        self.due_order = sorted(key for key, priority in self.indexed.values())
+        self._search_index = None
+        self._positions = None
+
+    def _read(self, tasks):
+        """Build the Tasks of stored dictionaries, giving each an ID."""
+        tasks = list(tasks)
+        loaded = [Task.from_dict(data) for data in tasks]
+        self.next_id = 1 + max(
+            (task.id for task in loaded if task.id is not None), default=0
+        )
+        self.assigned = False
+        self.normalized = False
+        for data, task in zip(tasks, loaded):
+            if task.id is None:
+                task.id = self.next_id
+                self.next_id += 1
+                self.assigned = True
+            if task.due_date != data.get('due_date', 'N/A'):
+                self.normalized = True
+        return loaded
+
+    @staticmethod
+    def _due_key(task):
+        """Return a task's key in the due date order."""
+        return task.day << ID_BITS | task.id
+
+    @property
+    def search_index(self):
+        """The TitleIndex of the task titles, built on first use."""
+        if self._search_index is None:
+            index = TitleIndex()
+            for task_id, title in self._titles():
+                index.add(task_id, title)
+            self._search_index = index
+        return self._search_index
+
+    def _titles(self):
+        """Yield each task's ID and title, in list order."""
+        for task_id, task in self.tasks.items():
+            yield task_id, task.title
+
+    @property
+    def positions(self):
+        """A number for each task ID that grows along the list order.
+
+        Built on first use; deletions leave gaps rather than renumbering.
+        """
+        if self._positions is None:
+            self._positions = {
+                task_id: position
+                for position, task_id in enumerate(self.tasks)
+            }
+            self._next_position = len(self._positions)
+        return self._positions
+
+    def _index_title(self, task_id, title):
+        if self._search_index is not None:
+            self._search_index.add(task_id, title)
+
+    def _unindex_title(self, task_id):
+        if self._search_index is not None:
+            self._search_index.remove(task_id)
+
+    def _index_fields(self, task):
+        """Index a task's due date and priority, if they changed."""
+        fields = (self._due_key(task), task.priority)
+        old = self.indexed.get(task.id)
+        if old == fields:
+            return
+        if old is not None:
+            self._unindex_fields(task.id)
+        self.indexed[task.id] = fields
+        self._index_due(fields[0])
+        self.by_priority.setdefault(task.priority, set()).add(task.id)
+
+    def _unindex_fields(self, task_id):
+        key, priority = self.indexed.pop(task_id)
+        self._unindex_due(key)
+        bucket = self.by_priority[priority]
+        bucket.discard(task_id)
+        if not bucket:
+            del self.by_priority[priority]
+
+    def _index_due(self, key):
+        insort(self.due_order, key)
+
+    def _unindex_due(self, key):
+        del self.due_order[bisect_left(self.due_order, key)]
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def __iter__(self):
+        return iter(self.tasks.values())
+
+    def __contains__(self, task_id):
+        return task_id in self.tasks
+
+    def to_dicts(self):
+        """Return the tasks as the list the storage backends save."""
+        return [task.to_dict() for task in self.tasks.values()]
+
+    def get(self, task_id):
+        """Return the task with an ID, or None if there is none."""
+        return self.tasks.get(task_id)
+
+    def add(self, task):
+        """Give a new task the next ID and append it.
+
+        Returns:
+            Task: The task, with its ``id`` set.
+        """
+        task.id = self.next_id
+        self.next_id += 1
+        self.tasks[task.id] = task
+        self._index_fields(task)
+        self._index_title(task.id, task.title)
+        if self._positions is not None:
+            self._positions[task.id] = self._next_position
+            self._next_position += 1
+        return task
+
+    def delete(self, task_id):
+        """Remove a task.
+
+        Returns:
+            Task: The removed task.
+
+        Raises:
+            KeyError: If there is no task with that ID.
+        """
+        task = self.tasks.pop(task_id)
+        self._unindex_fields(task_id)
+        self._unindex_title(task_id)
+        if self._positions is not None:
+            del self._positions[task_id]
+        return task
+
+    def mark_done(self, task_id):
+        """Mark a task as done.
+
+        Returns:
+            Task: The task.
+        """
+        task = self.tasks[task_id]
+        task.done = True
+        return task
+
+    def replace(self, task_id, task):
+        """Put a new version of a task in the old one's place."""
+        task.id = task_id
+        self.tasks[task_id] = task
+        self._index_fields(task)
+        self._index_title(task_id, task.title)
+
+    def completed(self):
+        """Return how many of the tasks are done."""
+        return sum(task.done for task in self.tasks.values())
+
+    def with_priority(self, priority):
+        """Return the tasks with a priority, in list order."""
+        return [task for task in self.tasks.values()
+                if task.priority == priority]
+
+    def matching(self, keyword):
+        """Return the tasks whose title contains a keyword, in list order.
+
+        The match is a case-insensitive substring match, checked only on
+        the candidates from the search index.
+        """
+        keyword = keyword.lower()
+        ids = self.search_index.candidates(keyword)
+        tasks = self if ids is None else map(self.tasks.__getitem__, ids)
+        return [task for task in tasks if keyword in task.title.lower()]
+
+    def ranked_matching(self, keyword, today=None, tasks=None):
+        """Return the tasks whose title contains a keyword, best first.
+
+        The tasks are those of ``matching``, ordered by the BM25
+        relevance of their title to the keyword, times a boost for their
+        priority and, if not done, one for how soon they are due; a task
+        due in a week gets half the due date boost of one due today, and
+        overdue tasks count as due today. Ties keep list order.
+
+        Args:
+            keyword (str): The keyword, matched case-insensitively.
+            today (date): The day due dates are measured from; today by
+                default.
+            tasks (list): The matching tasks in list order, if they were
+                already found, e.g. by the storage backend.
+        """
+        if tasks is None:
+            tasks = self.matching(keyword)
+        scores = self.search_index.scores(
+            keyword, [task.id for task in tasks]
+        )
+        today = (today or date.today()).toordinal()
+        for position, task in enumerate(tasks):
+            boost = PRIORITY_BOOSTS.get(task.priority, 1.0)
+            if task.due and not task.done:
+                days = max(task.day - today, 0)
+                boost *= 1 + DUE_BOOST / (1 + days / 7)
+            scores[position] *= boost
+        order = sorted(range(len(tasks)), key=scores.__getitem__,
+                       reverse=True)
+        return list(map(tasks.__getitem__, order))
+
+    def query(self, text):
+        """Return the tasks matching a query, in list order.
+
+        See ``search.parse_query`` for the syntax. The plan starts from
+        the most selective index the query can use: the keyword
+        candidates of one of its keywords, the tasks in its due date
+        range, or those with its priority. Each of these is cheap to
+        size, by its length, by bisecting the due date order or by
+        counting a bucket, and only the smallest is read, in one pass
+        that checks the whole query. A query using no index reads every
+        task.
+
+        Args:
+            text (str): The query, e.g. 'priority:high due:<2024-11-01'.
+
+        Raises:
+            ValueError: If the query cannot be parsed.
+        """
+        query = parse_query(text)
+        # (size, in list order, function returning the task IDs)
+        sources = []
+        for keyword in query.keywords:
+            ids = self.search_index.candidates(keyword)
+            if ids is not None:
+                sources.append((len(ids), True, ids.copy))
+        if query.undated or query.dated:
+            first = NO_DUE_DATE if query.undated else query.first_day or 0
+            last = (
+                NO_DUE_DATE if query.undated
+                else min(query.last_day or NO_DUE_DATE - 1, NO_DUE_DATE - 1)
+            )
+            low = bisect_left(self.due_order, first << ID_BITS)
+            high = bisect_left(self.due_order, (last + 1) << ID_BITS)
+            sources.append((max(high - low, 0), False, lambda: list(map(
+                ID_MASK.__and__, self.due_order[low:high]
+            ))))
+        if query.priority is not None:
+            sources.append((
+                self._priority_count(query.priority), True,
+                lambda: self._priority_ids(query.priority)
+            ))
+        if not sources:
+            return [task for task in self if query.matches(task)]
+        size, ordered, ids = min(sources, key=lambda source: source[0])
+        tasks = [task for task in self._by_ids(ids()) if query.matches(task)]
+        return tasks if ordered else self._in_list_order(tasks)
+
+    def _priority_count(self, priority):
+        return len(self.by_priority.get(priority, ()))
+
+    def _priority_ids(self, priority):
+        """Return the IDs of the tasks with a priority, in list order."""
+        bucket = self.by_priority.get(priority, ())
+        return sorted(bucket, key=self.positions.__getitem__)
+
+    def _in_list_order(self, tasks):
+        positions = self.positions
+        return sorted(tasks, key=lambda task: positions[task.id])
+
+    def fuzzy_matching(self, keyword, max_distance=2):
+        """Return the tasks with words near a keyword's, in list order.
+
+        Typos are forgiven: 'grocries' finds 'Buy groceries'. See
+        ``TitleIndex.fuzzy_candidates`` for how near a word must be.
+
+        Args:
+            keyword (str): The keyword, possibly misspelled.
+            max_distance (int): The most edits allowed per word.
+        """
+        return self._by_ids(
+            self.search_index.fuzzy_candidates(keyword, max_distance)
+        )
+
+    def _by_ids(self, ids):
+        """Return the tasks with some IDs, in that order."""
+        return list(map(self.tasks.__getitem__, ids))
+
+    def with_ids(self, ids):
+        """Return the tasks with some IDs, in that order.
+
+        IDs of tasks that are not in the list, e.g. because a storage
+        backend answered for tasks another session added, are skipped.
+        """
+        tasks = self.tasks
+        return [tasks[task_id] for task_id in ids if task_id in tasks]
+
+    def by_due_date(self):
+        """Return the tasks by due date, without changing the list order.
+
+        Tasks due 'N/A', or on a date that could not be read, come last,
+        and tasks due the same day come in the order they were added.
+        """
+        tasks = self.tasks
+        return [tasks[key & ID_MASK] for key in self.due_order]
+
+    def numbered(self, tasks=None):
+        """Number tasks for a table, remembering which ID each number is.
+
+        Args:
+            tasks (list): The tasks to show; all of them by default.
+
+        Returns:
+            list: ``(number, task)`` pairs, numbered from 1.
+        """
+        tasks = list(self if tasks is None else tasks)
+        self.numbers = [task.id for task in tasks]
+        return list(enumerate(tasks, 1))
+
+    def task_id(self, number):
+        """Return the ID of a task by its number in the last table.
+
+        Args:
+            number (str): The number the user typed.
+
+        Returns:
+            int: The task's ID, or None if the number is not in the table.
+        """
+        if not number.isdigit() or not 1 <= int(number) <= len(self.numbers):
+            return None
+        task_id = self.numbers[int(number) - 1]
+        return task_id if task_id in self else None
+
+
+def load_tasks(tasks):
+    """Index a user's stored tasks.
+
+    Args:
+        tasks (list): The user's tasks, as stored dictionaries.
+
+    Returns:
+        TaskList: The tasks.
+    """
+    return TaskList(tasks)
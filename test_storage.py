@@ -0,0 +1,328 @@
+import json
+import os
+import tempfile
+import unittest
+from storage import (
+    BACKENDS, CoalescingStore, ConflictError, JournalStore, open_store
+)
+from tasklist import load_tasks
+
+PASSWORD_HASH = '$2b$12$1oraKgjKN1DoMSlLk9LzD.ZoDx5ScgL7P/wKVV8xxIAtmIlYPdmRe'
+
+
+def make_task(task_id, title, priority='Medium', due_date='2030-01-05'):
+    return {
+        'task': title, 'priority': priority, 'due_date': due_date,
+        'done': False, 'id': task_id
+    }
+
+
+class StoreConformance:
+    """The behaviour every storage backend must share.
+
+    A test case for each of ``storage.BACKENDS`` is built below.
+    """
+
+    backend = None
+    # Whether two stores opened on one directory see each other's users
+    shared = True
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.store = self.open()
+
+    def open(self, directory=None, legacy_file=None):
+        store = open_store(
+            self.backend, directory=directory or self.directory.name,
+            legacy_file=legacy_file
+        )
+        self.addCleanup(store.close)
+        return store
+
+    def register(self, store, username, tasks=()):
+        user_data = {'password': PASSWORD_HASH, 'tasks': list(tasks)}
+        store.save_user(username, user_data)
+        return user_data
+
+    def add(self, store, username, user_data, task):
+        user_data['tasks'].append(task)
+        store.save_user(username, user_data, {'op': 'add', 'task': task})
+
+    def test_register_and_load(self):
+        self.register(self.store, 'alice')
+        user_data = self.store.load_user('alice')
+        self.assertEqual(user_data['password'], PASSWORD_HASH)
+        self.assertEqual(user_data['tasks'], [])
+        self.assertIn('version', user_data)
+
+    def test_missing_user(self):
+        self.assertIsNone(self.store.load_user('nobody'))
+        self.assertEqual(self.store.load_credentials(), {})
+        self.assertFalse(self.store.username_taken('nobody'))
+
+    def test_load_credentials(self):
+        self.register(self.store, 'alice')
+        self.register(self.store, 'bob')
+        self.assertEqual(
+            self.store.load_credentials(),
+            {'alice': PASSWORD_HASH, 'bob': PASSWORD_HASH}
+        )
+
+    def test_username_taken(self):
+        self.register(self.store, 'alice')
+        self.assertTrue(self.store.username_taken('alice'))
+        self.assertFalse(self.store.username_taken('alicia'))
+
+    def test_register_taken_name_conflicts(self):
+        self.register(self.store, 'alice')
+        with self.assertRaises(ConflictError):
+            self.register(self.store, 'alice')
+
+    def test_changes_by_id(self):
+        user_data = self.register(self.store, 'alice')
+        for task_id, title in ((3, 'Buy milk'), (7, 'Walk dog'),
+                               (9, 'Call mom')):
+            self.add(self.store, 'alice', user_data,
+                     make_task(task_id, title))
+        # Like run.py, change the loaded tasks and pass the change along
+        user_data = self.store.load_user('alice')
+        del user_data['tasks'][1]
+        self.store.save_user('alice', user_data, {'op': 'delete', 'id': 7})
+        user_data['tasks'][1]['done'] = True
+        self.store.save_user('alice', user_data, {'op': 'done', 'id': 9})
+        edited = make_task(3, 'Buy oat milk', 'High', 'N/A')
+        user_data['tasks'][0] = edited
+        self.store.save_user(
+            'alice', user_data, {'op': 'edit', 'id': 3, 'task': edited}
+        )
+        done = dict(make_task(9, 'Call mom'), done=True)
+        self.assertEqual(
+            self.store.load_user('alice')['tasks'], [edited, done]
+        )
+
+    def test_versions_grow(self):
+        user_data = self.register(self.store, 'alice')
+        first = self.store.load_user('alice')['version']
+        self.add(self.store, 'alice', user_data, make_task(1, 'Buy milk'))
+        self.assertEqual(user_data['version'], first + 1)
+        self.assertEqual(self.store.load_user('alice')['version'], first + 1)
+
+    def test_stale_save_conflicts(self):
+        self.register(self.store, 'alice')
+        first = self.store.load_user('alice')
+        second = self.store.load_user('alice')
+        self.add(self.store, 'alice', first, make_task(1, 'Buy milk'))
+        with self.assertRaises(ConflictError):
+            self.add(self.store, 'alice', second, make_task(1, 'Walk dog'))
+        self.assertEqual(
+            self.store.load_user('alice')['tasks'],
+            [make_task(1, 'Buy milk')]
+        )
+
+    def test_save_users_and_load_users(self):
+        users = {
+            'alice': {'password': PASSWORD_HASH,
+                      'tasks': [make_task(1, 'Buy milk')]},
+            'bob': {'password': PASSWORD_HASH, 'tasks': []}
+        }
+        self.store.save_users(users)
+        loaded = self.store.load_users()
+        self.assertEqual(set(loaded), {'alice', 'bob'})
+        self.assertEqual(loaded['alice']['tasks'], users['alice']['tasks'])
+        self.assertEqual(
+            self.store.load_user('alice')['tasks'], users['alice']['tasks']
+        )
+
+    def test_legacy_file_is_imported(self):
+        # Only a new store imports the legacy file
+        directory = os.path.join(self.directory.name, 'new')
+        os.mkdir(directory)
+        legacy_file = os.path.join(directory, 'legacy.json')
+        with open(legacy_file, 'w') as file:
+            json.dump({'alice': {
+                'password': PASSWORD_HASH,
+                'tasks': [make_task(1, 'Buy milk')]
+            }}, file)
+        store = self.open(directory, legacy_file)
+        self.assertEqual(
+            store.load_user('alice')['tasks'], [make_task(1, 'Buy milk')]
+        )
+        self.assertEqual(store.load_credentials(), {'alice': PASSWORD_HASH})
+
+    def test_coalesced_changes_are_written_on_flush(self):
+        store = CoalescingStore(self.store, max_changes=10, max_delay=60)
+        user_data = self.register(store, 'alice')
+        for task_id in range(1, 4):
+            self.add(store, 'alice', user_data,
+                     make_task(task_id, f'Task {task_id}'))
+        self.assertEqual(self.store.load_user('alice')['tasks'], [])
+        store.flush()
+        self.assertEqual(
+            len(self.store.load_user('alice')['tasks']), 3
+        )
+
+    def add_query_tasks(self, store):
+        user_data = self.register(store, 'alice')
+        for task in (
+            make_task(4, 'Buy milk', 'High', '2030-01-05'),
+            make_task(2, 'Email BUYER', 'Low', 'N/A'),
+            make_task(9, 'Walk dog', 'High', '2030-01-05'),
+            make_task(7, 'Call mom', 'Medium', '2029-12-31'),
+            make_task(5, 'Buy stamps', 'Low', '2030-1-2'),
+        ):
+            self.add(store, 'alice', user_data, task)
+        user_data['tasks'][3]['done'] = True
+        store.save_user('alice', user_data, {'op': 'done', 'id': 7})
+        return load_tasks(user_data['tasks'])
+
+    def ids(self, tasks):
+        return [task.id for task in tasks]
+
+    def test_indexed_queries_agree_with_task_list(self):
+        tasks = self.add_query_tasks(self.store)
+        if not self.store.INDEXED_QUERIES:
+            self.assertIsNone(self.store.task_ids_by_due_date('alice'))
+            return
+        for priority in ('High', 'Medium', 'Low'):
+            self.assertEqual(
+                self.store.task_ids_with_priority('alice', priority),
+                self.ids(tasks.with_priority(priority))
+            )
+        for keyword in ('buy', 'BUY', 'mom', 'x'):
+            self.assertEqual(
+                self.store.task_ids_matching('alice', keyword),
+                self.ids(tasks.matching(keyword))
+            )
+        self.assertEqual(
+            self.store.task_ids_by_due_date('alice'),
+            self.ids(tasks.by_due_date())
+        )
+        self.assertEqual(self.store.count_done('alice'), tasks.completed())
+        self.assertEqual(self.store.task_ids_matching('bob', 'buy'), [])
+
+    def test_coalesced_changes_are_flushed_before_queries(self):
+        store = CoalescingStore(self.store, max_changes=10, max_delay=60)
+        tasks = self.add_query_tasks(store)
+        if not self.store.INDEXED_QUERIES:
+            self.assertIsNone(store.task_ids_matching('alice', 'buy'))
+            return
+        self.assertEqual(
+            store.task_ids_matching('alice', 'buy'),
+            self.ids(tasks.matching('buy'))
+        )
+        self.assertEqual(store.count_done('alice'), 1)
+        self.assertEqual(len(self.store.load_user('alice')['tasks']), 5)
+
+    def second_store(self):
+        if not self.shared:
+            self.skipTest(f'{self.backend} stores share nothing')
+        return self.open()
+
+    def test_two_stores_see_registrations(self):
+        other = self.second_store()
+        self.assertEqual(self.store.load_credentials(), {})
+        self.register(other, 'alice')
+        self.assertEqual(
+            self.store.load_credentials(), {'alice': PASSWORD_HASH}
+        )
+        self.assertTrue(self.store.username_taken('alice'))
+        self.assertIsNotNone(self.store.load_user('alice'))
+        with self.assertRaises(ConflictError):
+            self.register(self.store, 'alice')
+
+    def test_two_stores_see_changes(self):
+        other = self.second_store()
+        self.register(self.store, 'alice')
+        mine = self.store.load_user('alice')
+        theirs = other.load_user('alice')
+        self.add(other, 'alice', theirs, make_task(1, 'Buy milk'))
+        self.assertEqual(
+            self.store.load_user('alice')['tasks'],
+            [make_task(1, 'Buy milk')]
+        )
+        with self.assertRaises(ConflictError):
+            self.add(self.store, 'alice', mine, make_task(1, 'Walk dog'))
+
+
+# One test case per backend, e.g. JournalStoreTest
+for backend in BACKENDS:
+    name = f'{backend.capitalize()}StoreTest'
+    globals()[name] = type(name, (StoreConformance, unittest.TestCase), {
+        'backend': backend, 'shared': backend != 'memory'
+    })
+
+
+class JournalCompactionTest(unittest.TestCase):
+    """Compaction folds the journal into the snapshot without loss."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def open(self):
+        store = open_store('journal', directory=self.directory.name)
+        self.addCleanup(store.close)
+        return store
+
+    def test_compaction_keeps_every_change(self):
+        store = self.open()
+        user_data = {'password': PASSWORD_HASH, 'tasks': []}
+        store.save_user('alice', user_data)
+        for task_id in range(1, 51):
+            task = make_task(task_id, f'Task {task_id}')
+            user_data['tasks'].append(task)
+            store.save_user('alice', user_data, {'op': 'add', 'task': task})
+            if task_id % 10 == 0:
+                store.compact()
+        self.assertEqual(store._sealed(), [])
+        self.assertEqual(store.load_user('alice')['tasks'],
+                         user_data['tasks'])
+        self.assertEqual(self.open().load_user('alice')['tasks'],
+                         user_data['tasks'])
+
+    def test_torn_last_line_is_dropped_before_appending(self):
+        store = self.open()
+        user_data = {'password': PASSWORD_HASH, 'tasks': []}
+        store.save_user('alice', user_data)
+        # A session died halfway through appending a record
+        with open(store.path, 'a') as file:
+            file.write('{"user":"alice","op":"add","ta')
+        task = make_task(1, 'Buy milk')
+        user_data['tasks'].append(task)
+        store.save_user('alice', user_data, {'op': 'add', 'task': task})
+        self.assertEqual(store.load_user('alice')['tasks'], [task])
+        self.assertEqual(store.load_credentials(), {'alice': PASSWORD_HASH})
+        store.compact()
+        self.assertEqual(self.open().load_user('alice')['tasks'], [task])
+
+    def test_compaction_by_another_store_is_seen(self):
+        store = self.open()
+        store.save_user('alice', {'password': PASSWORD_HASH, 'tasks': []})
+        self.assertEqual(store.load_credentials(), {'alice': PASSWORD_HASH})
+        other = self.open()
+        other.save_user('bob', {'password': PASSWORD_HASH, 'tasks': []})
+        other.compact()
+        self.assertEqual(
+            store.load_credentials(),
+            {'alice': PASSWORD_HASH, 'bob': PASSWORD_HASH}
+        )
+        self.assertIsNotNone(store.load_user('bob'))
+
+    def test_background_compaction_while_saving(self):
+        store = self.open()
+        self.assertIsInstance(store, JournalStore)
+        store.COMPACT_SIZE = 2048
+        user_data = {'password': PASSWORD_HASH, 'tasks': []}
+        store.save_user('alice', user_data)
+        for task_id in range(1, 201):
+            user_data = store.load_user('alice')
+            task = make_task(task_id, f'Task {task_id}')
+            user_data['tasks'].append(task)
+            store.save_user('alice', user_data, {'op': 'add', 'task': task})
+        store.close()
+        self.assertEqual(len(store.load_user('alice')['tasks']), 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,288 @@
+import random
+import unittest
+from datetime import date, timedelta
+from search import BKTree, TitleIndex, edit_distance, parse_query, words
+from storage import NO_DUE_DATE
+from tasklist import Task, TaskList, load_tasks
+
+WORDS = [
+    'buy', 'groceries', 'call', 'mentors', 'book', 'tickets', 'email',
+    'judges', 'visit', 'family', 'trip', 'conference', 'present', 'send'
+]
+
+
+def make_task(task_id, title, priority='Medium', due_date='2030-01-05',
+              done=False):
+    return {
+        'task': title, 'priority': priority, 'due_date': due_date,
+        'done': done, 'id': task_id
+    }
+
+
+def random_tasks(count, seed):
+    """Build tasks with clashing due days, and some without a date."""
+    rng = random.Random(seed)
+    tasks = []
+    for task_id in range(1, count + 1):
+        due_date = rng.choice([
+            'N/A', 'someday', '0001-01-01', '9999-12-31', '2024-2-29',
+            f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+            '2024-06-15'
+        ])
+        tasks.append(make_task(
+            task_id, ' '.join(rng.sample(WORDS, rng.randint(1, 3))),
+            rng.choice(['High', 'Medium', 'Low']), due_date,
+            rng.random() < 0.3
+        ))
+    rng.shuffle(tasks)
+    return tasks
+
+
+def ids(tasks):
+    return [task.id for task in tasks]
+
+
+class QueryPlanTest(unittest.TestCase):
+    """Every plan returns what checking each task would, in list order."""
+
+    QUERIES = [
+        'due:2024-06-15', 'due:<2024-06-15', 'due:<=2024-06-15',
+        'due:>2024-06-15', 'due:>=2024-06-15', 'due:0001-01-01',
+        'due:<=0001-01-01', 'due:9999-12-31', 'due:>=9999-12-31',
+        'due:>2024-01-01 due:<2024-07-01', 'due:2024-02-29',
+        'due:>2024-12-31 due:<2024-01-01', 'due:none', 'due:N/A',
+        'priority:high', 'done:true', 'done:no priority:low',
+        'book', '"buy groceries"', 'e', 'xyz', 'book due:none',
+        'priority:medium due:<2024-06-15 call', 'done:false due:>=2024-03-01'
+    ]
+
+    def setUp(self):
+        self.tasks = load_tasks(random_tasks(300, seed=7))
+
+    def check(self, tasks):
+        for text in self.QUERIES:
+            query = parse_query(text)
+            with self.subTest(query=text):
+                self.assertEqual(
+                    ids(tasks.query(text)),
+                    ids(task for task in tasks if query.matches(task))
+                )
+
+    def test_plans_agree_with_a_scan(self):
+        self.check(self.tasks)
+
+    def test_plans_agree_after_changes(self):
+        rng = random.Random(3)
+        for task_id in rng.sample(list(self.tasks.tasks), 100):
+            self.tasks.delete(task_id)
+        for task_id in rng.sample(list(self.tasks.tasks), 50):
+            self.tasks.replace(task_id, Task(
+                'send present', 'High',
+                date(2024, 6, 15) + timedelta(days=rng.randint(-2, 2))
+            ))
+        for number in range(50):
+            self.tasks.add(Task(
+                rng.choice(WORDS), 'Low', rng.choice([None, date(2024, 1, 1)])
+            ))
+        self.check(self.tasks)
+
+    def test_tasks_without_a_readable_date_are_undated(self):
+        tasks = load_tasks([
+            make_task(1, 'Buy milk', due_date='someday'),
+            make_task(2, 'Walk dog', due_date='N/A'),
+            make_task(3, 'Call mom', due_date='9999-12-31'),
+        ])
+        self.assertEqual(tasks.get(1).day, NO_DUE_DATE)
+        self.assertLess(tasks.get(3).day, NO_DUE_DATE)
+        self.assertEqual(ids(tasks.query('due:none')), [1, 2])
+        self.assertEqual(ids(tasks.query('due:>=9999-12-31')), [3])
+        self.assertEqual(ids(tasks.query('due:>2024-01-01')), [3])
+
+    def test_by_due_date_breaks_ties_by_id(self):
+        tasks = load_tasks([
+            make_task(5, 'Buy milk', due_date='N/A'),
+            make_task(9, 'Walk dog', due_date='2024-06-15'),
+            make_task(2, 'Call mom', due_date='2024-6-15'),
+            make_task(7, 'Send present', due_date='2024-06-14'),
+            make_task(1, 'Book trip', due_date='someday'),
+        ])
+        self.assertEqual(ids(tasks.by_due_date()), [7, 2, 9, 1, 5])
+        self.assertEqual(
+            ids(tasks.by_due_date()),
+            ids(sorted(tasks, key=lambda task: (task.day, task.id)))
+        )
+
+    def test_with_ids_skips_unknown_tasks(self):
+        tasks = load_tasks([make_task(1, 'Buy milk'), make_task(2, 'Walk')])
+        self.assertEqual(ids(tasks.with_ids([2, 8, 1])), [2, 1])
+
+
+class QueryErrorTest(unittest.TestCase):
+    """Queries that cannot be parsed raise ValueError."""
+
+    def test_invalid_queries(self):
+        for text in ('priority:urgent', 'done:maybe', 'due:2024-13-01',
+                     'due:<tomorrow', 'due:none due:2024-01-01',
+                     '"buy milk'):
+            with self.subTest(query=text):
+                with self.assertRaises(ValueError):
+                    parse_query(text)
+
+    def test_valid_queries(self):
+        query = parse_query('Priority:HIGH done:yes due:>=2024-1-5 Milk')
+        self.assertEqual(query.priority, 'High')
+        self.assertIs(query.done, True)
+        self.assertEqual(query.first_day, date(2024, 1, 5).toordinal())
+        self.assertIsNone(query.last_day)
+        self.assertEqual(query.keywords, ('milk',))
+
+    def test_task_list_query_raises(self):
+        with self.assertRaises(ValueError):
+            load_tasks([]).query('done:maybe')
+
+
+class CandidatesTest(unittest.TestCase):
+    """The search index never rules out a matching task."""
+
+    def setUp(self):
+        self.tasks = load_tasks(random_tasks(200, seed=11))
+        self.index = self.tasks.search_index
+
+    def test_trigrams_for_long_keywords(self):
+        for keyword in ('groc', 'y gr', 'ent'):
+            self.assertEqual(
+                self.index.candidates(keyword),
+                self.index.trigram_candidates(keyword)
+            )
+
+    def test_words_for_short_keywords(self):
+        for keyword in ('bu', 'a'):
+            self.assertIsNone(self.index.trigram_candidates(keyword))
+            self.assertEqual(
+                self.index.candidates(keyword),
+                self.index.word_candidates(keyword)
+            )
+        self.assertIsNone(self.index.candidates('-'))
+
+    def test_matching_agrees_with_a_scan(self):
+        for keyword in ('groc', 'y gr', 'bu', 'a', 'ENT', '-', 'zzz', ' '):
+            with self.subTest(keyword=keyword):
+                self.assertEqual(
+                    ids(self.tasks.matching(keyword)),
+                    ids(task for task in self.tasks
+                        if keyword.lower() in task.title.lower())
+                )
+
+    def test_edited_titles_are_reindexed(self):
+        tasks = load_tasks([make_task(1, 'Buy milk'), make_task(2, 'Walk')])
+        self.assertEqual(ids(tasks.matching('milk')), [1])
+        tasks.replace(1, Task('Buy bread', 'Low'))
+        tasks.add(Task('Oat milk', 'Low'))
+        self.assertEqual(ids(tasks.matching('milk')), [3])
+        tasks.delete(3)
+        self.assertEqual(tasks.matching('milk'), [])
+
+
+class FuzzyTest(unittest.TestCase):
+    """Typos are found within the allowed number of edits."""
+
+    def test_edit_distance(self):
+        self.assertEqual(edit_distance('kitten', 'sitting'), 3)
+        self.assertEqual(edit_distance('', 'abc'), 3)
+        self.assertEqual(edit_distance('groceries', 'grocries'), 1)
+        self.assertEqual(edit_distance('same', 'same'), 0)
+
+    def test_tree_search_agrees_with_a_scan(self):
+        rng = random.Random(5)
+        vocabulary = {
+            ''.join(rng.choice('abcde') for _ in range(rng.randint(1, 7)))
+            for _ in range(300)
+        }
+        tree = BKTree(vocabulary)
+        for word in ('abc', 'eeee', 'a', 'bcdeab'):
+            for max_distance in (0, 1, 2):
+                self.assertEqual(
+                    sorted(tree.search(word, max_distance)),
+                    sorted(other for other in vocabulary
+                           if edit_distance(word, other) <= max_distance)
+                )
+
+    def test_distance_limit(self):
+        index = TitleIndex()
+        for task_id, title in enumerate(
+                ['Buy groceries', 'Call mom', 'Walk dog'], 1):
+            index.add(task_id, title)
+        # Up to a third of the word's length, and at most max_distance
+        self.assertEqual(index.fuzzy_candidates('grocries', 2), [1])
+        self.assertEqual(index.fuzzy_candidates('grcries', 2), [1])
+        self.assertEqual(index.fuzzy_candidates('grcries', 1), [])
+        self.assertEqual(index.fuzzy_candidates('mon', 2), [2])
+        self.assertEqual(index.fuzzy_candidates('mo', 2), [])
+        self.assertEqual(index.fuzzy_candidates('calll mom', 2), [2])
+        self.assertEqual(index.fuzzy_candidates('dog cat', 2), [])
+        self.assertEqual(index.fuzzy_candidates('-', 2), [])
+
+    def test_removed_words_are_not_found(self):
+        tasks = TaskList([make_task(1, 'Buy groceries')])
+        self.assertEqual(ids(tasks.fuzzy_matching('grocries')), [1])
+        tasks.delete(1)
+        self.assertEqual(tasks.fuzzy_matching('grocries'), [])
+
+
+class RankingTest(unittest.TestCase):
+    """Ranked search orders by BM25, then priority and due date boosts."""
+
+    TODAY = date(2024, 6, 1)
+
+    def rank(self, tasks, keyword):
+        return ids(load_tasks(tasks).ranked_matching(keyword, self.TODAY))
+
+    def test_shorter_titles_rank_higher(self):
+        self.assertEqual(self.rank([
+            make_task(1, 'Email judges about the conference trip', 'Low'),
+            make_task(2, 'Email judges', 'Low'),
+        ], 'judges'), [2, 1])
+
+    def test_rarer_words_weigh_more(self):
+        tasks = [make_task(1, 'Call family', 'Low')]
+        tasks += [make_task(task_id, 'Visit family', 'Low')
+                  for task_id in range(2, 6)]
+        tasks.append(make_task(6, 'Call mentors', 'Low'))
+        self.assertEqual(self.rank(tasks, 'call family')[0], 1)
+        scores = load_tasks(tasks).search_index.scores('call family', [1, 2])
+        self.assertGreater(scores[0], scores[1])
+
+    def test_priority_and_due_date_boosts(self):
+        self.assertEqual(self.rank([
+            make_task(1, 'Buy milk', 'Low', 'N/A'),
+            make_task(2, 'Buy milk', 'High', 'N/A'),
+            make_task(3, 'Buy milk', 'Low', '2024-06-01'),
+            make_task(4, 'Buy milk', 'Low', '2024-06-01', done=True),
+        ], 'milk'), [2, 3, 1, 4])
+
+    def test_ties_keep_list_order(self):
+        self.assertEqual(self.rank([
+            make_task(9, 'Buy milk', 'Low', 'N/A'),
+            make_task(2, 'Buy milk', 'Low', 'N/A'),
+        ], 'milk'), [9, 2])
+
+    def test_given_matches_are_ranked(self):
+        tasks = load_tasks([
+            make_task(1, 'Buy milk', 'Low'),
+            make_task(2, 'Buy milk', 'High'),
+            make_task(3, 'Walk dog', 'High'),
+        ])
+        self.assertEqual(
+            ids(tasks.ranked_matching(
+                'milk', self.TODAY, tasks.with_ids([1, 2])
+            )),
+            [2, 1]
+        )
+
+    def test_words(self):
+        self.assertEqual(words('Buy MILK, buy bread!'),
+                         {'buy', 'milk', 'bread'})
+
+
+if __name__ == '__main__':
+    unittest.main()